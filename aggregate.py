@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+"""
+Summary stats across iterations, built up one iteration at a time.
+
+Each iteration's summary (uploaded blocks and completion round for every
+peer) is folded into an IterationStats as soon as it's ready, and then
+dropped, so memory doesn't grow with the number of iterations.  Per peer
+it keeps:
+  - the mean and variance of uploaded blocks and of the completion round
+    (Welford's method, with an exact running sum for the mean, so the
+    means come out the same as averaging a list)
+  - a QuantileSketch of each, for percentiles
+  - how many iterations the peer finished in
+
+Folding the same summaries in the same order gives the same result, so
+serial and pooled runs agree.  Everything can also be merged, for
+combining stats that were built up separately.
+"""
+
+import math
+
+
+class RunningStats:
+    """Count, mean and variance of a stream of numbers."""
+    def __init__(self):
+        self.n = 0
+        self.total = 0      # exact for ints
+        self.m = 0.0        # running mean
+        self.m2 = 0.0       # sum of squared differences from the mean
+
+    def add(self, x):
+        self.n += 1
+        self.total += x
+        delta = x - self.m
+        self.m += delta / float(self.n)
+        self.m2 += delta * (x - self.m)
+
+    def merge(self, other):
+        if other.n == 0:
+            return
+        if self.n == 0:
+            (self.n, self.total, self.m, self.m2) = (
+                other.n, other.total, other.m, other.m2)
+            return
+        n = self.n + other.n
+        delta = other.m - self.m
+        self.m += delta * other.n / float(n)
+        self.m2 += other.m2 + delta * delta * self.n * other.n / float(n)
+        self.n = n
+        self.total += other.total
+
+    def mean(self):
+        """Throws a div by zero exception if nothing was added"""
+        return self.total / float(self.n)
+
+    def stddev(self):
+        """Population standard deviation, like util.stddev."""
+        if self.n == 0:
+            return 0
+        return math.sqrt(max(self.m2, 0.0) / self.n)
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles of non-negative numbers, to within a relative
+    error of `accuracy`.  Values are counted in buckets whose bounds grow
+    geometrically, so the sketch stays small however many values go in,
+    and two sketches merge by adding up their buckets.
+    """
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = dict()   # bucket index -> count; zeros go in None
+        self.n = 0
+
+    def bucket(self, x):
+        if x <= 0:
+            return None
+        return int(math.ceil(math.log(x) / self.log_gamma))
+
+    def add(self, x):
+        b = self.bucket(x)
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+        self.n += 1
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Can't merge sketches of different accuracy")
+        for (b, count) in other.buckets.items():
+            self.buckets[b] = self.buckets.get(b, 0) + count
+        self.n += other.n
+
+    def value(self, b):
+        """A value to stand for bucket b, (gamma^(b-1), gamma^b]."""
+        if b is None:
+            return 0
+        (lo, hi) = (self.gamma ** (b - 1), self.gamma ** b)
+        whole = math.floor(hi)
+        if lo < whole and whole - 1 <= lo:
+            # Only one whole number fits, so small counts come out exact
+            return int(whole)
+        return 2 * hi / (self.gamma + 1)
+
+    def quantile(self, q):
+        """The q'th quantile (0 <= q <= 1), or None if nothing was added."""
+        if self.n == 0:
+            return None
+        # Nearest rank, rounding halves up
+        rank = int(math.floor(q * (self.n - 1) + 0.5))
+        seen = 0
+        for b in sorted(self.buckets, key=lambda k: (k is not None, k)):
+            seen += self.buckets[b]
+            if rank < seen:
+                return self.value(b)
+
+
+class PeerStats:
+    def __init__(self):
+        self.uploaded = RunningStats()
+        self.uploaded_sketch = QuantileSketch()
+        self.completion = RunningStats()
+        self.completion_sketch = QuantileSketch()
+
+    def merge(self, other):
+        self.uploaded.merge(other.uploaded)
+        self.uploaded_sketch.merge(other.uploaded_sketch)
+        self.completion.merge(other.completion)
+        self.completion_sketch.merge(other.completion_sketch)
+
+
+class IterationStats:
+    """Per-peer stats over the iterations folded in so far."""
+    def __init__(self, peer_ids):
+        self.peer_ids = peer_ids[:]
+        self.iterations = 0
+        self.peers = dict((pid, PeerStats()) for pid in peer_ids)
+
+    def add(self, summary):
+        """
+        summary: (uploaded blocks dict, completion rounds dict) for one
+        iteration, as returned by Sim.run_iteration.
+        """
+        (uploaded, completion) = summary
+        self.iterations += 1
+        for pid in self.peer_ids:
+            s = self.peers[pid]
+            s.uploaded.add(uploaded[pid])
+            s.uploaded_sketch.add(uploaded[pid])
+            if completion[pid] is not None:
+                s.completion.add(completion[pid])
+                s.completion_sketch.add(completion[pid])
+
+    def merge(self, other):
+        """Fold in stats for other iterations of the same peers."""
+        self.iterations += other.iterations
+        for pid in self.peer_ids:
+            self.peers[pid].merge(other.peers[pid])
+
+    def completion_rate(self, peer_id):
+        """Fraction of the iterations peer_id finished in."""
+        if self.iterations == 0:
+            return None
+        return self.peers[peer_id].completion.n / float(self.iterations)
+
+    def quantiles(self, peer_id, qs=(0.1, 0.5, 0.9)):
+        """
+        Returns ([uploaded blocks quantiles], [completion round quantiles]),
+        the latter over the iterations the peer finished in.
+        """
+        s = self.peers[peer_id]
+        return ([s.uploaded_sketch.quantile(q) for q in qs],
+                [s.completion_sketch.quantile(q) for q in qs])
+
+    def stats(self):
+        """
+        Returns dict: peer_id -> (uploaded mean, uploaded stddev,
+                                  completion mean, completion stddev)
+        The completion stats are None if the peer didn't finish every time.
+        """
+        ans = dict()
+        for pid in self.peer_ids:
+            s = self.peers[pid]
+            if s.completion.n == self.iterations:
+                (c_mean, c_stddev) = (s.completion.mean(), s.completion.stddev())
+            else:
+                (c_mean, c_stddev) = (None, None)
+            ans[pid] = (s.uploaded.mean(), s.uploaded.stddev(), c_mean, c_stddev)
+        return ans
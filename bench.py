@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+"""
+Scaling benchmark for the simulation engine.
+
+Runs a set of cases that scale the number of peers, the number of pieces
+and the number of rounds, for each of the shipped agents (with Seed peers
+seeding every case), and reports for each case:
+  - rounds per second
+  - time spent in each phase of the round loop, and in each agent class
+  - peak memory (max RSS) of the process
+
+Each case runs in its own subprocess so peak memory isn't shared between
+cases.  Results can be saved as a JSON baseline and compared against later:
+
+  python bench.py --scale small --save-baseline before.json
+  ... change something ...
+  python bench.py --scale small --compare before.json
+
+--interpreters runs every case under each of several Python interpreters
+(say python2.7,python3,pypy3) and compares their rounds/sec against the
+first one.
+
+--scale full goes up to 10k peers and 100k pieces, and takes a long time.
+"""
+
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+from sim import Sim, make_parser, make_config, configure_logging
+from timing import PHASES
+
+AGENTS = ["Dummy", "GlazStd", "GlazPropShare", "GlazTyrant", "GlazTourney"]
+
+SCALES = {
+    "small": {"peers": [10, 100],
+              "pieces": [3, 100, 1000],
+              "rounds": [10, 100]},
+    "full": {"peers": [10, 100, 1000, 10000],
+             "pieces": [3, 100, 1000, 10000, 100000],
+             "rounds": [10, 100, 1000]},
+}
+
+
+def make_cases(scale, agents):
+    """
+    Return a list of case dicts: name, agents (list of class names),
+    num_pieces, max_round.  Rounds cases use enough pieces that nobody
+    finishes early.
+    """
+    s = SCALES[scale]
+    cases = []
+
+    def add(kind, n, agent, num_seeds, num_agents, num_pieces, max_round):
+        cases.append({"name": "%s-%d-%s" % (kind, n, agent),
+                      "agents": ["Seed"] * num_seeds + [agent] * num_agents,
+                      "num_pieces": num_pieces,
+                      "max_round": max_round})
+
+    for agent in agents:
+        for n in s["peers"]:
+            seeds = max(1, n // 10)
+            add("peers", n, agent, seeds, n - seeds, 32, 10)
+        for n in s["pieces"]:
+            add("pieces", n, agent, 2, 8, n, 10)
+        for n in s["rounds"]:
+            add("rounds", n, agent, 2, 8, max(1000, 10 * n), n)
+    return cases
+
+
+def interpreter():
+    """This interpreter, as results are matched against baselines by."""
+    return "%s %d.%d" % ((platform.python_implementation(),) +
+                         tuple(sys.version_info[:2]))
+
+
+def run_case(case, seed, phases, repeat=1):
+    """
+    Run one case in this process and return its results dict.  The
+    times are from the fastest of `repeat` runs; with phases, the runs
+    are timed by the sim's own --timings.
+    """
+    args = ["--num-pieces", str(case["num_pieces"]),
+            "--max-round", str(case["max_round"])]
+    if phases:
+        args.append("--timings")
+    (options, _) = make_parser().parse_args(args)
+    config = make_config(options, case["agents"])
+    configure_logging("warning")
+
+    elapsed = None
+    for _ in range(repeat):
+        random.seed(seed)
+        start = time.time()
+        h = Sim(config).run_sim_once()
+        t = time.time() - start
+        if elapsed is None or t < elapsed:
+            (elapsed, history) = (t, h)
+    rounds = history.last_round() + 1
+    # Linux reports KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    result = {"name": case["name"],
+              "interpreter": interpreter(),
+              "rounds": rounds,
+              "seconds": elapsed,
+              "rounds_per_sec": rounds / elapsed if elapsed > 0 else None,
+              "peak_mb": peak_mb}
+    if phases:
+        timings = history.timings
+        result["phases"] = dict((name, wall) for (name, (wall, _))
+                                in timings.phases.items())
+        result["agent_classes"] = dict((name, wall) for (name, (wall, _, _))
+                                       in timings.agent_classes.items())
+    return result
+
+
+def run_case_subprocess(case, seed, phases, repeat, python=None):
+    """
+    Run one case in a fresh interpreter (this one, unless python is
+    given).  Returns its results dict.
+    """
+    args = [python or sys.executable, os.path.abspath(__file__),
+            "--run-case", json.dumps(case), "--seed", str(seed),
+            "--repeat", str(repeat)]
+    if not phases:
+        args.append("--no-phases")
+    try:
+        p = subprocess.Popen(args, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError as e:
+        return {"name": case["name"], "error": str(e)}
+    (out, err) = p.communicate()
+    if p.returncode != 0:
+        lines = err.decode("utf-8", "replace").strip().splitlines()
+        return {"name": case["name"],
+                "error": lines[-1] if lines else "exit %d" % p.returncode}
+    return json.loads(out.decode("utf-8").strip().splitlines()[-1])
+
+
+def compare_interpreters(results, interpreters):
+    """
+    Print each case's rounds/sec under every interpreter, and how it
+    compares to the first.
+    """
+    by_key = dict(((r["name"], r["python"]), r) for r in results)
+    names = []
+    for r in results:
+        if r["name"] not in names:
+            names.append(r["name"])
+    print("%-28s " % "case" +
+          " ".join("%18s" % python[-18:] for python in interpreters))
+    for name in names:
+        base = by_key[(name, interpreters[0])].get("rounds_per_sec")
+        cols = []
+        for python in interpreters:
+            rate = by_key[(name, python)].get("rounds_per_sec")
+            if not rate:
+                cols.append("%18s" % "-")
+            elif python == interpreters[0] or not base:
+                cols.append("%18.1f" % rate)
+            else:
+                cols.append("%10.1f (%4.2fx)" % (rate, rate / base))
+        print("%-28s " % name + " ".join(cols))
+
+
+def format_result(r):
+    if "error" in r:
+        return "%-28s ERROR %s" % (r["name"], r["error"])
+    line = "%-28s %6d rounds %8.3fs %10.1f rounds/s %8.1f MB" % (
+        r["name"], r["rounds"], r["seconds"], r["rounds_per_sec"] or 0,
+        r["peak_mb"])
+    if "phases" in r:
+        line += "  " + " ".join("%s=%.3f" % (name, r["phases"][name])
+                                for name in PHASES)
+    if "agent_classes" in r:
+        line += "  " + " ".join("%s=%.3f" % (name, r["agent_classes"][name])
+                                for name in sorted(r["agent_classes"]))
+    return line
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print each case's rounds/sec against the baseline run of the same
+    case under the same interpreter (implementation and version, however
+    it was started).  Baselines saved before results named their
+    interpreter are matched by case name alone.  Returns the names of
+    cases that got slower by more than tolerance (a fraction).
+    """
+    old = dict(((b["name"], b.get("interpreter")), b)
+               for b in baseline["results"])
+    slower = []
+    for r in results:
+        b = old.get((r["name"], r.get("interpreter")),
+                    old.get((r["name"], None)))
+        label = r["name"]
+        if "python" in r:
+            label = "%s: %s" % (r["python"], r["name"])
+        if b is None or "error" in r or "error" in b:
+            print("%-28s  no comparison" % label)
+            continue
+        if not (r["rounds_per_sec"] and b["rounds_per_sec"]):
+            continue
+        ratio = r["rounds_per_sec"] / b["rounds_per_sec"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  SLOWER"
+            slower.append(r["name"])
+        print("%-28s %8.2fx rounds/s  %+8.1f MB%s" % (
+            label, ratio, r["peak_mb"] - b["peak_mb"], flag))
+    return slower
+
+
+def main(args):
+    usage_msg = "Usage:  %prog [options]"
+    parser = OptionParser(usage=usage_msg)
+    parser.add_option("--scale",
+                      dest="scale", default="small",
+                      help="Case sizes: 'small' or 'full'")
+    parser.add_option("--agents",
+                      dest="agents", default=",".join(AGENTS),
+                      help="Comma-separated agent classes to benchmark")
+    parser.add_option("--only",
+                      dest="only", default=None,
+                      help="Only run cases whose name matches this regex")
+    parser.add_option("--seed",
+                      dest="seed", default=0, type="int",
+                      help="Random seed for every case")
+    parser.add_option("--repeat",
+                      dest="repeat", default=3, type="int",
+                      help="Runs per case; the fastest is reported")
+    parser.add_option("--no-phases",
+                      dest="phases", default=True, action="store_false",
+                      help="Don't time the phases of each round")
+    parser.add_option("--interpreters",
+                      dest="interpreters", default=None,
+                      help="Comma-separated Python executables to run every "
+                      "case under, compared against the first")
+    parser.add_option("--save-baseline",
+                      dest="save_baseline", default=None,
+                      help="Write the results to this JSON file")
+    parser.add_option("--compare",
+                      dest="compare", default=None,
+                      help="Compare against a baseline JSON file")
+    parser.add_option("--tolerance",
+                      dest="tolerance", default=0.1, type="float",
+                      help="Slowdown (as a fraction) that --compare reports "
+                      "as a regression")
+    parser.add_option("--run-case",
+                      dest="run_case", default=None,
+                      help="(internal) run one JSON case and print its results")
+
+    (options, _) = parser.parse_args(args[1:])
+
+    if options.run_case is not None:
+        case = json.loads(options.run_case)
+        print(json.dumps(run_case(case, options.seed, options.phases,
+                                  options.repeat)))
+        return
+
+    if options.scale not in SCALES:
+        parser.error("Unknown scale: %s" % options.scale)
+    cases = make_cases(options.scale, options.agents.split(","))
+    if options.only is not None:
+        cases = [c for c in cases if re.search(options.only, c["name"])]
+
+    interpreters = [None]
+    if options.interpreters is not None:
+        interpreters = options.interpreters.split(",")
+
+    results = []
+    for case in cases:
+        for python in interpreters:
+            r = run_case_subprocess(case, options.seed, options.phases,
+                                    options.repeat, python)
+            if python is not None:
+                r["python"] = python
+                print("%s: %s" % (python, format_result(r)))
+            else:
+                print(format_result(r))
+            sys.stdout.flush()
+            results.append(r)
+
+    if len(interpreters) > 1:
+        print("")
+        compare_interpreters(results, interpreters)
+
+    if options.save_baseline is not None:
+        with open(options.save_baseline, "w") as f:
+            json.dump({"scale": options.scale,
+                       "python": sys.version.split()[0],
+                       "results": results}, f, indent=1, sort_keys=True)
+
+    if options.compare is not None:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        print("")
+        if compare(results, baseline, options.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+"""
+CPU time budgets for agents.
+
+Budgets are set per agent class: a limit on each requests() / uploads()
+call, and a limit on the total over the whole run.  A call that goes over
+its limit counts as returning no requests / uploads, and a peer that runs
+through its run budget isn't called again; both are recorded as
+violations.
+
+When the agents run on the main thread, calls are interrupted as soon as
+they run out of time (with a SIGPROF timer), so a stuck agent can't hold
+up the sim.  Otherwise calls are timed and their results thrown away
+afterwards.
+
+The interruption is an OverBudget exception raised inside the agent.  It
+derives from BaseException, like KeyboardInterrupt, so `except
+Exception:` in an agent doesn't catch it.  An agent with a bare
+`except:` can still catch it, so it's raised again every RETRY_INTERVAL
+until the call returns, and a call that was interrupted counts as over
+budget whatever it returns.
+"""
+
+import logging
+import signal
+import threading
+
+from timing import thread_time
+
+# Class name that sets the budget for classes without one of their own.
+ANY_CLASS = "*"
+
+# CPU seconds between interruptions of a call that's already over budget
+RETRY_INTERVAL = 0.01
+
+
+def parse_budgets(specs):
+    """
+    specs: list of "Class=CALL_MS[:RUN_MS]" strings, where either limit
+    may be left empty.  Returns dict : class name -> (call seconds or None,
+    run seconds or None).  Raises ValueError on a bad spec.
+    """
+    def ms(s):
+        if s == "":
+            return None
+        v = float(s)
+        if v <= 0:
+            raise ValueError("Budgets must be positive: %s" % s)
+        return v / 1000.0
+
+    budgets = dict()
+    for spec in specs:
+        try:
+            (name, limits) = spec.split("=", 1)
+            parts = limits.split(":")
+            if len(parts) > 2:
+                raise ValueError()
+            call = ms(parts[0])
+            run = ms(parts[1]) if len(parts) == 2 else None
+            if call is None and run is None:
+                raise ValueError()
+        except ValueError:
+            raise ValueError("Bad budget: %s" % spec)
+        budgets[name] = (call, run)
+    return budgets
+
+
+class OverBudget(BaseException):
+    """Raised in an agent's call when it runs out of time."""
+    pass
+
+
+class BudgetEnforcer:
+    def __init__(self, budgets, violations):
+        """
+        budgets: dict : class name -> (call seconds, run seconds), as
+                 returned by parse_budgets.
+        violations: dict : peer_id -> list, to append
+                    (round, "requests" / "uploads", "call" / "run") to.
+        """
+        self.budgets = budgets
+        self.violations = violations
+        self.used = dict()        # peer_id -> cpu seconds used so far
+        self.exhausted = set()    # peer ids out of run budget
+        self.armed = False
+        self.fired = False        # the current call was interrupted
+        self.installed = False
+        self.old_handler = None
+
+    def __getstate__(self):
+        # The signal handler belongs to the running process
+        state = dict(self.__dict__)
+        state.update(armed=False, fired=False, installed=False,
+                     old_handler=None)
+        return state
+
+    def start(self):
+        """Install the SIGPROF handler, if calls can be interrupted."""
+        if hasattr(signal, "setitimer") and self.on_main_thread():
+            self.old_handler = signal.signal(signal.SIGPROF, self.on_timer)
+            self.installed = True
+
+    def close(self):
+        if self.installed:
+            signal.signal(signal.SIGPROF, self.old_handler)
+            self.installed = False
+            self.old_handler = None
+
+    def on_main_thread(self):
+        return threading.current_thread().name == "MainThread"
+
+    def on_timer(self, signum, frame):
+        # Stays armed, so an agent that swallows this gets it again
+        if self.armed:
+            self.fired = True
+            raise OverBudget()
+
+    def limits(self, p):
+        return self.budgets.get(p.__class__.__name__,
+                                self.budgets.get(ANY_CLASS))
+
+    def flag(self, round, p, phase, kind):
+        logging.warning("%s went over its %s budget in %s, round %d",
+                        p.id, kind, phase, round)
+        self.violations[p.id].append((round, phase, kind))
+
+    def call(self, round, p, phase, f, *args):
+        """
+        Call f(*args) on behalf of peer p, for the given phase
+        ("requests" or "uploads").  Returns its result, or [] if p went
+        over budget.
+        """
+        limits = self.limits(p)
+        if limits is None:
+            return f(*args)
+        if p.id in self.exhausted:
+            return []
+        (call_limit, run_limit) = limits
+
+        # Whichever limit is nearer decides when to interrupt the call
+        stop_after = [x for x in (call_limit, run_limit) if x is not None]
+        if run_limit is not None:
+            stop_after[-1] = max(run_limit - self.used.get(p.id, 0.0), 1e-6)
+        timed = self.installed and self.on_main_thread()
+
+        ans = None
+        self.fired = False
+        start = thread_time()
+        if timed:
+            self.armed = True
+            signal.setitimer(signal.ITIMER_PROF, min(stop_after),
+                             RETRY_INTERVAL)
+        try:
+            try:
+                ans = f(*args)
+            finally:
+                # Once disarmed the timer can't raise, so nothing after
+                # this can be interrupted.
+                self.armed = False
+                if timed:
+                    signal.setitimer(signal.ITIMER_PROF, 0)
+        except OverBudget:
+            pass
+        interrupted = self.fired
+        used = thread_time() - start
+        self.used[p.id] = self.used.get(p.id, 0.0) + used
+
+        if run_limit is not None and self.used[p.id] > run_limit:
+            self.exhausted.add(p.id)
+            self.flag(round, p, phase, "run")
+            return []
+        if interrupted or (call_limit is not None and used > call_limit):
+            self.flag(round, p, phase, "call")
+            return []
+        return ans
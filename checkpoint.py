@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+"""
+Round-level checkpoints, so a long simulation can be resumed.
+
+A checkpoint is two files:
+  PATH         snapshot of everything except the history's rounds: agents,
+               piece state, availability, RNG state, ...  Replaced
+               atomically each time.
+  PATH.rounds  append-only journal with one record per completed round
+               (that round's downloads and uploads).
+
+Each save only appends the rounds since the previous save to the journal,
+and the files are written on a background thread, so the round loop
+only pays for pickling the snapshot.
+"""
+
+import os
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class CheckpointWriter:
+    def __init__(self, path, journal_size=0):
+        """
+        journal_size: bytes of an existing journal to keep, when carrying
+        on from a checkpoint that was resumed.
+        """
+        self.path = path
+        self.journal_path = path + ".rounds"
+        self.journal_size = journal_size
+        self.pending = []    # [(downloads, uploads)] not yet journaled
+        self.thread = None
+        self.error = None
+
+    def add_round(self, downloads, uploads):
+        self.pending.append((downloads, uploads))
+
+    def save(self, state):
+        """
+        state: dict of everything needed to carry on from here, other than
+        the rounds passed to add_round().  It is pickled right away, so the
+        caller may keep changing it; the writing happens in the background.
+        """
+        rounds = b"".join(pickle.dumps(r, pickle.HIGHEST_PROTOCOL)
+                         for r in self.pending)
+        self.pending = []
+        offset = self.journal_size
+        self.journal_size += len(rounds)
+        state = dict(state, journal_size=self.journal_size)
+        snapshot = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+        self.wait()
+        self.thread = threading.Thread(target=self._write,
+                                       args=(rounds, offset, snapshot))
+        self.thread.start()
+
+    def _write(self, rounds, offset, snapshot):
+        try:
+            # The journal goes first, so a snapshot on disk never refers
+            # to rounds that aren't there.
+            mode = "r+b" if offset > 0 else "wb"
+            with open(self.journal_path, mode) as f:
+                f.seek(offset)
+                f.truncate()
+                f.write(rounds)
+                f.flush()
+                os.fsync(f.fileno())
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """Block until the last save is on disk."""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            e = self.error
+            self.error = None
+            raise e
+
+    close = wait
+
+
+def load_checkpoint(path):
+    """
+    Return (state, rounds): the dict passed to the last completed save,
+    and the list of (downloads, uploads) for every round it covers.
+    """
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    rounds = []
+    with open(path + ".rounds", "rb") as f:
+        while f.tell() < state["journal_size"]:
+            rounds.append(pickle.load(f))
+    return (state, rounds)
@@ -10,66 +10,67 @@ import random
 import logging
 from math import floor
 
-from messages import Upload, Request
+from messages import Upload, RequestBatch
 from util import even_split
 from peer import Peer
+from pieceset import PieceSet
 
 class GlazPropShare(Peer):
+    idle_when_done = True
+    idle_without_requests = True
+    request_batches = True
+    history_window = 1   # last round's downloads
+
     def post_init(self):
-        print "post_init(): %s here!" % self.id
+        print("post_init(): %s here!" % self.id)
 
     def requests(self, peers, history):
         """
         peers: available info about the peers (who has what pieces)
         history: what's happened so far as far as this peer can see
 
-        returns: a list of Request() objects
+        returns: a RequestBatch of requests
 
         This will be called after update_pieces() with the most recent state.
         """
         needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
 
         # list of integers representing ids of pieces needed
-        needed_pieces = filter(needed, range(len(self.pieces)))
-        np_set = set(needed_pieces)
+        needed_pieces = [i for i in range(len(self.pieces)) if needed(i)]
+        np_set = PieceSet.from_ids(needed_pieces)
 
-        requests = []   # We'll put all the things we want here
+        requests = RequestBatch()   # We'll put all the things we want here
 
-        # count frequency of each needed piece among available pieces from peers,
-        # keeping track of owners of each needed piece
-        piece_frequency = {piece:0 for piece in needed_pieces}
+        # keep track of owners of each needed piece (the sim already counts
+        # how many peers have each piece, see self.rarity)
         piece_ownerid = {piece:[] for piece in needed_pieces}
         for peer in peers:
 
             # get pieces that peer has and we need
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            isect = peer.available_pieces & np_set
 
-            # iterate through and update frequency and owner of piece
+            # iterate through and update owner of piece
             for piece in isect:
-                piece_frequency[piece] += 1;
                 piece_ownerid[piece].append(peer.id)
 
-        # get list of needed pieces as (piece_id, frequency) list and randomly shuffle
-        # to make sure that not all agents request same pieces with same rarity at the same time
+        # randomly shuffle needed pieces to make sure that not all agents
+        # request same pieces with same rarity at the same time
         # (since all start at rarity 2)
-        piece_frequency_items = piece_frequency.items()
-        random.shuffle(piece_frequency_items)
+        random.shuffle(needed_pieces)
 
         # sort list by rarity (increasing frequency)
-        piece_frequency_items = sorted(piece_frequency_items, key=lambda x: x[1])
+        rarest_first = self.rarity.rarest(needed_pieces)
 
         # iterate through list and request each piece from each of its current owners
-        for (piece_id, _) in piece_frequency_items:
+        for piece_id in rarest_first:
             start_block = self.pieces[piece_id]
             for owner in piece_ownerid[piece_id]:
-                r = Request(self.id, owner, piece_id, start_block)
-                requests.append(r)
+                requests.add(self.id, owner, piece_id, start_block)
         return requests
 
     def uploads(self, requests, peers, history):
         """
-        requests -- a list of the requests for this peer for this round
+        requests -- a RequestBatch of the requests for this peer for this round
         peers -- available info about all the peers
         history -- history for all previous rounds
 
@@ -93,7 +94,7 @@ class GlazPropShare(Peer):
             # Step 1: Calculate bandwidth for all requesters that have uploaded to us
 
             # count total downloaded blocks from each peer in last round
-            downloads_per_peer = {peer.from_id:peer.blocks for peer in last_round_dl}
+            downloads_per_peer = dict(zip(last_round_dl.from_ids, last_round_dl.blocks))
 
             # calculate total blocks downloaded from requesters
             total_blocks = 0
@@ -101,7 +102,7 @@ class GlazPropShare(Peer):
                 total_blocks += blocks
 
             # determine requesters not downloaded from last round
-            reqs = set([req.requester_id for req in requests])
+            reqs = set(requests.requester_ids)
             downloaded_reqs = set(downloads_per_peer.keys())
             remaining = reqs - downloaded_reqs
 
@@ -115,7 +116,7 @@ class GlazPropShare(Peer):
 
                 # Step 2: optimistically unchoke 1 peer not downloaded from
                 bws.append(self.up_bw - sum(bws))
-                chosen.append(random.choice(list(remaining)))
+                chosen.append(random.choice(sorted(remaining)))
             # if all requesters uploaded last round, allocate 100% accordingly
             else:
                 # unchoke each peer and calculate bandwidth
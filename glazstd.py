@@ -9,13 +9,19 @@
 import random
 import logging
 
-from messages import Upload, Request
+from messages import Upload, RequestBatch
 from util import even_split
 from peer import Peer
+from pieceset import PieceSet
 
 class GlazStd(Peer):
+    idle_when_done = True
+    idle_without_requests = True
+    request_batches = True
+    history_window = 2   # last two rounds' downloads
+
     def post_init(self):
-        print "post_init(): %s here!" % self.id
+        print("post_init(): %s here!" % self.id)
         self.optimistic_id = None
  
     def requests(self, peers, history):
@@ -23,53 +29,48 @@ class GlazStd(Peer):
         peers: available info about the peers (who has what pieces)
         history: what's happened so far as far as this peer can see
 
-        returns: a list of Request() objects
+        returns: a RequestBatch of requests
 
         This will be called after update_pieces() with the most recent state.
         """
         needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
 
         # list of integers representing ids of pieces needed
-        needed_pieces = filter(needed, range(len(self.pieces)))
-        np_set = set(needed_pieces)
+        needed_pieces = [i for i in range(len(self.pieces)) if needed(i)]
+        np_set = PieceSet.from_ids(needed_pieces)
 
-        requests = []   # We'll put all the things we want here
+        requests = RequestBatch()   # We'll put all the things we want here
         
-        # count frequency of each needed piece among available pieces from peers,
-        # keeping track of owners of each needed piece
-        piece_frequency = {piece:0 for piece in needed_pieces}
+        # keep track of owners of each needed piece (the sim already counts
+        # how many peers have each piece, see self.rarity)
         piece_ownerid = {piece:[] for piece in needed_pieces}
         for peer in peers:
 
             # get pieces that peer has and we need
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            isect = peer.available_pieces & np_set
 
-            # iterate through and update frequency and owner of piece
+            # iterate through and update owner of piece
             for piece in isect:
-                piece_frequency[piece] += 1;
                 piece_ownerid[piece].append(peer.id)
 
-        # get list of needed pieces as (piece_id, frequency) list and randomly shuffle
-        # to make sure that not all agents request same pieces with same rarity at the same time
+        # randomly shuffle needed pieces to make sure that not all agents
+        # request same pieces with same rarity at the same time
         # (since all start at rarity 2)
-        piece_frequency_items = piece_frequency.items()
-        random.shuffle(piece_frequency_items)
+        random.shuffle(needed_pieces)
 
         # sort list by rarity (increasing frequency)
-        piece_frequency_items = sorted(piece_frequency_items, key=lambda x: x[1])
+        rarest_first = self.rarity.rarest(needed_pieces)
 
         # iterate through list and request each piece from each of its current owners
-        for (piece_id, _) in piece_frequency_items:
+        for piece_id in rarest_first:
             start_block = self.pieces[piece_id]
             for owner in piece_ownerid[piece_id]:
-                r = Request(self.id, owner, piece_id, start_block)
-                requests.append(r)
+                requests.add(self.id, owner, piece_id, start_block)
         return requests
 
     def uploads(self, requests, peers, history):
         """
-        requests -- a list of the requests for this peer for this round
+        requests -- a RequestBatch of the requests for this peer for this round
         peers -- available info about all the peers
         history -- history for all previous rounds
 
@@ -97,14 +98,13 @@ class GlazStd(Peer):
 
             # count total downloaded blocks from each peer in last 2 rounds
             downloads_per_peer = {peer.id:0 for peer in peers}
-            for dl in last_round_dl:
-                downloads_per_peer[dl.from_id] += dl.blocks
-            for dl in second_last_round_dl:
-                downloads_per_peer[dl.from_id] += dl.blocks
+            for dls in (last_round_dl, second_last_round_dl):
+                for (from_id, blocks) in zip(dls.from_ids, dls.blocks):
+                    downloads_per_peer[from_id] += blocks
 
             # sort peers with requests by amount downloaded from them
-            requester_ids = set([r.requester_id for r in requests])
-            cooperative_peers = sorted(requester_ids, key=lambda x:downloads_per_peer[x])
+            requester_ids = set(requests.requester_ids)
+            cooperative_peers = sorted(sorted(requester_ids), key=lambda x:downloads_per_peer[x])
 
             # choose S-1 most cooperative peers that have requests to unchoke
             chosen = cooperative_peers[:S-1]
@@ -113,7 +113,7 @@ class GlazStd(Peer):
             if round % 3 == 0 or not self.optimistic_id:
                 unchosen_requesters = set(requester_ids) - set(chosen)
                 if len(unchosen_requesters) > 0:
-                    self.optimistic_id = random.choice(tuple(unchosen_requesters))
+                    self.optimistic_id = random.choice(sorted(unchosen_requesters))
                     chosen.append(self.optimistic_id)
             else:
                 chosen.append(self.optimistic_id)
@@ -9,13 +9,19 @@
 import random
 import logging
 
-from messages import Upload, Request
+from messages import Upload, RequestBatch
 from util import even_split
 from peer import Peer
+from pieceset import PieceSet
 
 class GlazTyrant(Peer):
+    # uploads() updates its estimates every round, so it always runs
+    idle_when_done = True
+    request_batches = True
+    history_window = 2   # uploads from two rounds back
+
     def post_init(self):
-        print "post_init(): %s here!" % self.id
+        print("post_init(): %s here!" % self.id)
         self.consecutive_unchokes = {}
         self.expected_dl = {}
         self.expected_ul = {}
@@ -25,51 +31,46 @@ class GlazTyrant(Peer):
         peers: available info about the peers (who has what pieces)
         history: what's happened so far as far as this peer can see
 
-        returns: a list of Request() objects
+        returns: a RequestBatch of requests
 
         This will be called after update_pieces() with the most recent state.
         """
         needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
-        needed_pieces = filter(needed, range(len(self.pieces)))
-        np_set = set(needed_pieces)
+        needed_pieces = [i for i in range(len(self.pieces)) if needed(i)]
+        np_set = PieceSet.from_ids(needed_pieces)
 
-        requests = []   # We'll put all the things we want here
+        requests = RequestBatch()   # We'll put all the things we want here
         
-        # count frequency of each needed piece among available pieces from peers,
-        # keeping track of owners of each needed piece
-        piece_frequency = {piece:0 for piece in needed_pieces}
+        # keep track of owners of each needed piece (the sim already counts
+        # how many peers have each piece, see self.rarity)
         piece_ownerid = {piece:[] for piece in needed_pieces}
         for peer in peers:
 
             # get pieces that peer has and we need
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            isect = peer.available_pieces & np_set
 
-            # iterate through and update frequency and owner of piece
+            # iterate through and update owner of piece
             for piece in isect:
-                piece_frequency[piece] += 1;
                 piece_ownerid[piece].append(peer.id)
 
-        # get list of needed pieces as (piece_id, frequency) list and randomly shuffle
-        # to make sure that not all agents request same pieces with same rarity at the same time
+        # randomly shuffle needed pieces to make sure that not all agents
+        # request same pieces with same rarity at the same time
         # (since all start at rarity 2)
-        piece_frequency_items = piece_frequency.items()
-        random.shuffle(piece_frequency_items)
+        random.shuffle(needed_pieces)
 
         # sort list by rarity (increasing frequency)
-        piece_frequency_items = sorted(piece_frequency_items, key=lambda x: x[1])
+        rarest_first = self.rarity.rarest(needed_pieces)
 
         # iterate through list and request each piece from each of its current owners
-        for (piece_id, _) in piece_frequency_items:
+        for piece_id in rarest_first:
             start_block = self.pieces[piece_id]
             for owner in piece_ownerid[piece_id]:
-                r = Request(self.id, owner, piece_id, start_block)
-                requests.append(r)
+                requests.add(self.id, owner, piece_id, start_block)
         return requests
 
     def uploads(self, requests, peers, history):
         """
-        requests -- a list of the requests for this peer for this round
+        requests -- a RequestBatch of the requests for this peer for this round
         peers -- available info about all the peers
         history -- history for all previous rounds
 
@@ -94,7 +95,7 @@ class GlazTyrant(Peer):
         if self.expected_ul == {}:
             self.expected_ul = {peer.id: 1 for peer in peers}
         
-        requester_ids = set([r.requester_id for r in requests])
+        requester_ids = set(requests.requester_ids)
         peer_ids = set([peer.id for peer in peers])
 
         # count total downloaded blocks from each peer in last round,
@@ -106,16 +107,15 @@ class GlazTyrant(Peer):
             downloads_per_peer = {peer.id:0 for peer in peers}
             unchoked_ids = set([])
 
-            for dl in last_dl:
-                downloads_per_peer[dl.from_id] += dl.blocks
-                unchoker_ids.add(dl.from_id)
-            for ul in second_last_ul:
-                unchoked_ids.add(ul.from_id)
+            for (from_id, blocks) in zip(last_dl.from_ids, last_dl.blocks):
+                downloads_per_peer[from_id] += blocks
+                unchoker_ids.add(from_id)
+            unchoked_ids.update(second_last_ul.from_ids)
 
             for peer_id in unchoker_ids:
                 self.expected_dl[peer_id] = downloads_per_peer[peer_id]
                 self.consecutive_unchokes[peer_id] += 1
-                if self.consecutive_unchokes >= r:
+                if self.consecutive_unchokes[peer_id] >= r:
                     self.expected_ul[peer_id] *= (1 - c)
             
             for peer_id in peer_ids - unchoker_ids:
@@ -123,7 +123,7 @@ class GlazTyrant(Peer):
                 self.consecutive_unchokes[peer_id] = 0
 
         chosen = set([])
-        cooperative_peers = sorted(requester_ids, key=lambda x: -float(self.expected_dl[x]) / float(self.expected_ul[x]))
+        cooperative_peers = sorted(sorted(requester_ids), key=lambda x: -float(self.expected_dl[x]) / float(self.expected_ul[x]))
         k, ul_bw, uploads = 0, 0, []
         for peer_id in cooperative_peers:
             temp = ul_bw + self.expected_ul[peer_id]
@@ -136,7 +136,7 @@ class GlazTyrant(Peer):
         unchosen = set(requester_ids) - chosen
         if len(unchosen) == 0:
             unchosen = set(peer_ids) - chosen
-        optimistic_id = random.choice(tuple(unchosen))
+        optimistic_id = random.choice(sorted(unchosen))
         uploads.append(Upload(self.id, optimistic_id, (self.up_bw - ul_bw)))
 
         return uploads
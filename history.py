@@ -1,19 +1,206 @@
 #!/usr/bin/python
 
-import copy
 import pprint
+from array import array
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from messages import DownloadBatch, UploadBatch
+from historyfile import (SpillTable, DOWNLOAD_RECORD, UPLOAD_RECORD,
+                         table_paths, write_meta, number)
+
+
+class MessageTable:
+    """
+    Append-only store of one kind of message (downloads or uploads) for
+    the whole sim, as typed columns: round, from, to, then the message's
+    own numbers.  Peers are stored as their index in peer_ids.
+
+    Each round appends every peer's batch in peer_ids order, so a peer's
+    rows for a round are contiguous:
+      offsets[r * num_peers + i] : offsets[r * num_peers + i + 1]
+    are the rows for peer i in round r.
+
+    Old rounds can be dropped from the front with drop_before().  Rounds
+    and offsets keep counting from the start of the sim, so first_round
+    and row_base say where the columns now begin.  If spill is set (a
+    historyfile.SpillTable), dropped rounds are written to it, and are
+    read back from it when looked up.
+    """
+    def __init__(self, peer_ids, batch_class, num_values):
+        """
+        batch_class: DownloadBatch or UploadBatch.  Its first two columns
+        are the from and to peer ids, and the rest are the num_values
+        numbers, kept as integers unless an agent hands us a float.
+        """
+        self.peer_ids = peer_ids
+        self.index = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.batch_class = batch_class
+        self.rounds = 0
+        self.first_round = 0
+        self.row_base = 0
+        self.round_col = array("i")
+        self.from_col = array("i")
+        self.to_col = array("i")
+        self.values = [array("l") for _ in range(num_values)]
+        self.offsets = array("l", [0])
+        self.spill = None
+
+    def append_round(self, batches):
+        """batches: dict : peer_id -> batch for the next round"""
+        index = self.index
+        r = self.rounds
+        for pid in self.peer_ids:
+            b = batches[pid]
+            columns = b.columns()
+            n = len(b)
+            if n:
+                self.round_col.extend([r] * n)
+                self.from_col.extend([index[x] for x in columns[0]])
+                self.to_col.extend([index[x] for x in columns[1]])
+                for (k, column) in enumerate(columns[2:]):
+                    self.extend_values(k, column)
+            self.offsets.append(self.row_base + len(self.round_col))
+        self.rounds += 1
+
+    def extend_values(self, k, column):
+        col = self.values[k]
+        n = len(col)
+        try:
+            col.extend(column)
+        except TypeError:
+            # Fractional blocks or bandwidth: switch the column to floats
+            del col[n:]
+            col = self.values[k] = array("d", col)
+            col.extend(column)
+
+    def rows_for(self, r, i):
+        """(start, end) of peer i's rows in round r."""
+        k = (r - self.first_round) * len(self.peer_ids) + i
+        return (self.offsets[k] - self.row_base,
+                self.offsets[k + 1] - self.row_base)
+
+    def round_start(self, r):
+        """Where round r's rows start (or would, for the next round)."""
+        k = (r - self.first_round) * len(self.peer_ids)
+        return self.offsets[k] - self.row_base
+
+    def drop_before(self, r):
+        """Forget every round before r."""
+        if r <= self.first_round:
+            return
+        cut = self.round_start(r)
+        if self.spill is not None:
+            self.spill.append(self.raw_rows(0, cut))
+        for col in [self.round_col, self.from_col, self.to_col] + self.values:
+            del col[:cut]
+        del self.offsets[:(r - self.first_round) * len(self.peer_ids)]
+        self.row_base += cut
+        self.first_round = r
+
+    def oldest(self):
+        """The oldest round that can still be looked up."""
+        return 0 if self.spill is not None else self.first_round
+
+    def raw_rows(self, a, b):
+        """Rows a up to b as (round, from index, to index, values...)."""
+        columns = [self.round_col, self.from_col, self.to_col] + self.values
+        for j in range(a, b):
+            yield tuple(c[j] for c in columns)
+
+    def batch(self, r, i):
+        """Peer i's messages in round r, as a batch."""
+        if r < self.first_round:
+            return self.spill.batch(r, i)
+        (a, b) = self.rows_for(r, i)
+        ids = self.peer_ids
+        return self.batch_class([ids[k] for k in self.from_col[a:b]],
+                                [ids[k] for k in self.to_col[a:b]],
+                                *[c[a:b].tolist() for c in self.values])
+
+    def rows(self, start=None, end=None):
+        """
+        (round, from_id, to_id, values...) for every message in rounds
+        start up to (not including) end, in order.  Defaults to every
+        round that can still be looked up.  Whole amounts come out as
+        ints, as they do from a spilled history, whether or not the column
+        has had to hold fractions.
+        """
+        start = self.oldest() if start is None else max(start, self.oldest())
+        end = self.rounds if end is None else min(end, self.rounds)
+        if start < self.first_round:
+            for row in self.spill.rows(start, min(end, self.first_round)):
+                yield row
+            start = self.first_round
+        if start >= end:
+            return
+        (a, b) = (self.round_start(start), self.round_start(end))
+        ids = self.peer_ids
+        for j in range(a, b):
+            yield ((self.round_col[j], ids[self.from_col[j]],
+                    ids[self.to_col[j]]) +
+                   tuple(number(c[j]) for c in self.values))
+
+
+class PeerRounds:
+    """
+    Read-only list of one peer's batches, one per round, read out of a
+    MessageTable as they're asked for.  Indexes are round numbers, and
+    len() is the number of rounds played, even if the oldest rounds have
+    been dropped or are outside the peer's window; looking those up
+    raises IndexError, and iterating skips them.
+    """
+    def __init__(self, table, peer_index, window=None):
+        """window: how many of the latest rounds can be looked up, or None"""
+        self.table = table
+        self.peer_index = peer_index
+        self.window = window
+
+    def first(self):
+        """The oldest round that can be looked up."""
+        first = self.table.oldest()
+        if self.window is not None:
+            first = max(first, len(self) - self.window)
+        return first
+
+    def __len__(self):
+        return self.table.rounds
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            return [self[i] for i in range(*r.indices(len(self)))]
+        n = len(self)
+        if r < 0:
+            r += n
+        if r < 0 or r >= n:
+            raise IndexError("round out of range")
+        if r < self.first():
+            raise IndexError("round %d is outside the history window" % r)
+        return self.table.batch(r, self.peer_index)
+
+    def __iter__(self):
+        for r in range(self.first(), len(self)):
+            yield self.table.batch(r, self.peer_index)
+
+    def __repr__(self):
+        return repr(list(self))
 
 
 class AgentHistory:
     """
     History available to a single peer
 
-    history.downloads: [[Download objects for round]]  (one sublist for each round)
+    history.downloads: [DownloadBatch for round]  (one for each round)
          All the downloads _to_ this agent.
         
-    history.uploads: [[Upload objects for round]]  (one sublist for each round)
+    history.uploads: [UploadBatch for round]  (one for each round)
          All the downloads _from_ this agent.
 
+    Both are read-only views of the sim's History: each round's batch is
+    made when it's looked up.  When the sim runs with --bounded-history,
+    only the last history_window rounds (see Peer) can be looked up.
     """
     def __init__(self, peer_id, downloads, uploads):
         """
@@ -32,39 +219,136 @@ class AgentHistory:
 
     def __repr__(self):
         return "AgentHistory(downloads=%s, uploads=%s)" % (
-            pprint.pformat(self.downloads),
-            pprint.pformat(self.uploads))
+            pprint.pformat(list(self.downloads)),
+            pprint.pformat(list(self.uploads)))
 
 
 class History:
     """History of the whole sim"""
-    def __init__(self, peer_ids, upload_rates):
+    def __init__(self, peer_ids, upload_rates, windows=None):
         """
         uploads:
-                   dict : peer_id -> [[uploads] -- one list per round]
+                   dict : peer_id -> [UploadBatch -- one per round]
         downloads:
-                   dict : peer_id -> [[downloads] -- one list per round]
+                   dict : peer_id -> [DownloadBatch -- one per round]
                    
         Keep track of the uploads _from_ and downloads _to_ the
-        specified peer id.
+        specified peer id.  Both are views of download_table and
+        upload_table, which hold every round's messages as columns.
+
+        windows: None to keep every round, or dict : peer_id -> how many
+        past rounds that peer's agent looks at (None for all of them).
+        Then only the rounds some agent can still see are kept (and at
+        least the latest one), and each agent can only see its own window.
+
+        Running totals over every round, kept up to date by update() so
+        the stats don't need the rounds themselves:
+          uploaded: dict : peer_id -> blocks uploaded
+          downloaded: dict : peer_id -> blocks downloaded
+          downloaded_from: dict : peer_id -> (dict : source peer_id -> blocks)
         """
         self.upload_rates = upload_rates  # peer_id -> up_bw
         self.peer_ids = peer_ids[:]
 
         self.round_done = dict()   # peer_id -> round finished
-        self.downloads = dict((pid, []) for pid in peer_ids)
-        self.uploads = dict((pid, []) for pid in peer_ids)
+        self.windows = windows
+        self.keep_rounds = None
+        if windows is not None and None not in windows.values():
+            self.keep_rounds = max([1] + list(windows.values()))
+        self.uploaded = dict((pid, 0) for pid in peer_ids)
+        self.downloaded = dict((pid, 0) for pid in peer_ids)
+        self.downloaded_from = dict((pid, dict()) for pid in peer_ids)
+        # Set by spill()
+        self.spill_path = None
+        self.spill_keep = None
+        # columns: round, from, to, piece, blocks
+        self.download_table = MessageTable(self.peer_ids, DownloadBatch, 2)
+        # columns: round, from, to, bw
+        self.upload_table = MessageTable(self.peer_ids, UploadBatch, 1)
+        self.downloads = dict((pid, PeerRounds(self.download_table, i))
+                              for (i, pid) in enumerate(self.peer_ids))
+        self.uploads = dict((pid, PeerRounds(self.upload_table, i))
+                            for (i, pid) in enumerate(self.peer_ids))
+        # peer_id -> [(round, phase, "call" / "run")] for each time the
+        # peer went over its CPU budget
+        self.budget_violations = dict((pid, []) for pid in peer_ids)
+        # timing.Timings for the run, if it was timed
+        self.timings = None
 
     def update(self, dls, ups):
         """
-        dls: dict : peer_id -> [downloads] -- downloads for this round
-        ups: dict : peer_id -> [uploads] -- uploads for this round
+        dls: dict : peer_id -> DownloadBatch -- downloads for this round
+        ups: dict : peer_id -> UploadBatch -- uploads for this round
 
         append these downloads to to the history
         """
+        uploaded = self.uploaded
         for pid in self.peer_ids:
-            self.downloads[pid].append(dls[pid])
-            self.uploads[pid].append(ups[pid])
+            ds = dls[pid]
+            if len(ds) == 0:
+                continue
+            by_source = self.downloaded_from[pid]
+            total = 0
+            for (from_id, blocks) in zip(ds.from_ids, ds.blocks):
+                uploaded[from_id] += blocks
+                by_source[from_id] = by_source.get(from_id, 0) + blocks
+                total += blocks
+            self.downloaded[pid] += total
+
+        self.download_table.append_round(dls)
+        self.upload_table.append_round(ups)
+        keep = self.keep_rounds
+        if self.spill_path is not None:
+            keep = self.spill_keep
+        if keep is not None:
+            self.drop_before(self.download_table.rounds - keep)
+
+    def spill(self, path, keep_rounds=1):
+        """
+        From now on, write rounds to the history file at path (see
+        historyfile.py) once they're keep_rounds old, rather than keep
+        them in memory.  Spilled rounds can still be looked up, through a
+        memory mapping.  Call before the first update(), and call close()
+        when the run is over to finish the file.
+        """
+        if self.last_round() >= 0:
+            raise ValueError("Can only spill a history from the start")
+        (dl_path, ul_path) = table_paths(path)
+        self.download_table.spill = SpillTable(
+            dl_path, DOWNLOAD_RECORD, 2, self.peer_ids, DownloadBatch, write=True)
+        self.upload_table.spill = SpillTable(
+            ul_path, UPLOAD_RECORD, 1, self.peer_ids, UploadBatch, write=True)
+        self.spill_path = path
+        self.spill_keep = max(keep_rounds, 1)
+
+    def close(self):
+        """
+        If spilling, write out the rest of the rounds and finish the file.
+        The JSON part goes last, once the rows are all on disk, so a file
+        that has it is complete.
+        """
+        if self.spill_path is not None:
+            self.drop_before(self.download_table.rounds)
+            self.download_table.spill.finish()
+            self.upload_table.spill.finish()
+            write_meta(self.spill_path, self)
+
+    def drop_before(self, r):
+        """Forget (or spill) every round before r."""
+        self.download_table.drop_before(r)
+        self.upload_table.drop_before(r)
+
+    def first_round(self):
+        """index of the oldest round that can still be looked up"""
+        return self.download_table.oldest()
+
+    def download_rows(self, start=None, end=None):
+        """
+        (round, from_id, to_id, piece, blocks) for every download in rounds
+        start up to (not including) end that can still be looked up, in
+        the order they happened.
+        """
+        return self.download_table.rows(start, end)
 
     def peer_is_done(self, round, peer_id):
         # Only save the _first_ round where we hear this
@@ -72,33 +356,58 @@ class History:
             self.round_done[peer_id] = round
 
     def peer_history(self, peer_id):
-        return AgentHistory(peer_id, self.downloads[peer_id], self.uploads[peer_id])
+        if self.windows is None:
+            return AgentHistory(peer_id, self.downloads[peer_id],
+                                self.uploads[peer_id])
+        i = self.download_table.index[peer_id]
+        window = self.windows[peer_id]
+        return AgentHistory(peer_id,
+                            PeerRounds(self.download_table, i, window),
+                            PeerRounds(self.upload_table, i, window))
 
     def last_round(self):
         """index of the last completed round"""
-        p = self.peer_ids[0]
-        return len(self.downloads[p])-1
+        return self.download_table.rounds-1
 
-    def pretty_for_round(self, r):
-        s = "\nRound %s:\n" % r
+    def write_round(self, f, r):
+        """Write what everyone downloaded in round r to the file-like f."""
+        f.write("\nRound %s:\n" % r)
         for peer_id in self.peer_ids:
             ds = self.downloads[peer_id][r]
-            stringify = lambda d: "%s downloaded %d blocks of piece %d from %s\n" % (
-                peer_id, d.blocks, d.piece, d.from_id)
-            s += "".join(map(stringify, ds))
-        return s
+            for (blocks, piece, from_id) in zip(ds.blocks, ds.pieces,
+                                                ds.from_ids):
+                f.write("%s downloaded %d blocks of piece %d from %s\n" % (
+                    peer_id, blocks, piece, from_id))
+
+    def write_report(self, f, start=0, end=None):
+        """
+        Write the download history for rounds start through end (inclusive;
+        None means the last round) to the file-like f, one round at a time,
+        so the whole report never has to be in memory.  Rounds that have
+        been dropped are skipped.
+        """
+        f.write("History\n")
+        last = self.last_round()
+        if end is not None:
+            last = min(end, last)
+        for r in range(max(start, self.first_round()), last+1):
+            self.write_round(f, r)
+
+    def pretty_for_round(self, r):
+        out = StringIO()
+        self.write_round(out, r)
+        return out.getvalue()
 
     def pretty(self):
-        s = "History\n"
-        for r in range(self.last_round()+1):
-            s += self.pretty_for_round(r)
-        return s
+        out = StringIO()
+        self.write_report(out)
+        return out.getvalue()
 
     def __repr__(self):
         return """History(
 uploads=%s
 downloads=%s
 )""" % (
-    pprint.pformat(self.uploads),
-    pprint.pformat(self.downloads))
+    pprint.pformat(dict((pid, list(u)) for (pid, u) in self.uploads.items())),
+    pprint.pformat(dict((pid, list(d)) for (pid, d) in self.downloads.items())))
 
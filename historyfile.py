@@ -0,0 +1,266 @@
+#!/usr/bin/python
+
+"""
+History spilled to disk, for runs whose history doesn't fit in memory.
+
+A spilled history is three files:
+  PATH            JSON: peer ids, upload rates, rounds, completion rounds,
+                  budget violations and the running totals.  Written when
+                  the run finishes.
+  PATH.downloads  one fixed-size record per download:
+                  round, from, to, piece (int32) and blocks (float64)
+  PATH.uploads    one record per upload: round, from, to (int32), bw (float64)
+
+Peers are stored as their index in the peer ids.  Records are written a
+round at a time, and within a round grouped by the peer the downloads
+went to (or the uploads came from), in peer id order.  That order lets a
+round range or a (round, peer) be found with a binary search through the
+memory mapping, without reading the rest of the file.
+
+SpilledHistory opens a finished file and can be passed to the Stats
+functions in place of a History:
+
+  h = SpilledHistory("run.hist")
+  Stats.uploaded_blocks(h.peer_ids, h)
+  for (round, from_id, to_id, piece, blocks) in h.download_rows(0, 10,
+                                                                peer="Seed0"):
+      ...
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+
+FORMAT_VERSION = 2
+
+DOWNLOAD_RECORD = struct.Struct("<iiiid")
+UPLOAD_RECORD = struct.Struct("<iiid")
+
+
+def number(x):
+    """Amounts are stored as floats; give whole ones back as ints."""
+    i = int(x)
+    return i if i == x else x
+
+
+class SpillTable:
+    """
+    One kind of message on disk: appended to a round at a time, and read
+    back through a memory mapping.
+    """
+    def __init__(self, path, record, owner, peer_ids, batch_class=None,
+                 write=False):
+        """
+        record: DOWNLOAD_RECORD or UPLOAD_RECORD
+        owner: field the records are grouped by within a round (2 for the
+               downloads' to, 1 for the uploads' from)
+        batch_class: what batch() returns
+        write: start a new file, rather than open a finished one
+        """
+        self.path = path
+        self.record = record
+        self.owner = owner
+        self.peer_ids = peer_ids
+        self.batch_class = batch_class
+        self.fields = len(record.unpack(b"\0" * record.size))
+        self.f = open(path, "w+b" if write else "rb")
+        self.size = os.fstat(self.f.fileno()).st_size
+        self.mm = None
+        self.mapped = 0
+
+    def append(self, rows):
+        """rows: (round, from index, to index, values...) tuples"""
+        data = b"".join(self.record.pack(*row) for row in rows)
+        if not data:
+            return
+        self.f.write(data)
+        self.size += len(data)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.f.close()
+
+    def finish(self):
+        """
+        Done appending: get everything onto disk, and close the file for
+        writing.  It's opened again read-only, so rows can still be read.
+        """
+        self.close()
+        self.f = open(self.path, "rb")
+        self.mapped = 0
+
+    def view(self):
+        """The mapping, redone if rows were added since it was made."""
+        if self.mapped != self.size:
+            if self.mm is not None:
+                self.mm.close()
+                self.mm = None
+            self.f.flush()
+            if self.size:
+                self.mm = mmap.mmap(self.f.fileno(), self.size,
+                                    access=mmap.ACCESS_READ)
+            self.mapped = self.size
+        return self.mm
+
+    def __len__(self):
+        return self.size // self.record.size
+
+    def key(self, mm, j):
+        row = self.record.unpack_from(mm, j * self.record.size)
+        return (row[0], row[self.owner])
+
+    def lower_bound(self, key):
+        """Index of the first record at or after key: (round, owner index)."""
+        mm = self.view()
+        (lo, hi) = (0, len(self))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mm, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def raw_rows(self, a, b):
+        mm = self.view()
+        unpack = self.record.unpack_from
+        size = self.record.size
+        for j in range(a, b):
+            yield unpack(mm, j * size)
+
+    def rows(self, start=None, end=None, peer=None, source=None):
+        """
+        (round, from_id, to_id, amounts...) for the records in rounds start
+        up to (not including) end, optionally only those to peer and / or
+        from source (peer ids).
+        """
+        ids = self.peer_ids
+        index = dict((pid, i) for (i, pid) in enumerate(ids))
+        a = 0 if start is None else self.lower_bound((start, -1))
+        b = len(self) if end is None else self.lower_bound((end, -1))
+        # Grouped by owner within each round, so an owner's rows can be
+        # found round by round; otherwise filter while scanning.
+        to_i = index[peer] if peer is not None else None
+        from_i = index[source] if source is not None else None
+        owner_i = to_i if self.owner == 2 else from_i
+        if owner_i is not None and a < b:
+            (first, last) = (self.key(self.view(), a)[0],
+                             self.key(self.view(), b - 1)[0])
+            spans = [(self.lower_bound((r, owner_i)),
+                      self.lower_bound((r, owner_i + 1)))
+                     for r in range(first, last + 1)]
+        else:
+            spans = [(a, b)]
+        for (a, b) in spans:
+            for row in self.raw_rows(a, b):
+                if to_i is not None and row[2] != to_i:
+                    continue
+                if from_i is not None and row[1] != from_i:
+                    continue
+                yield ((row[0], ids[row[1]], ids[row[2]]) +
+                       tuple(number(x) for x in row[3:]))
+
+    def batch(self, r, i):
+        """Peer i's messages in round r, as a batch."""
+        a = self.lower_bound((r, i))
+        b = self.lower_bound((r, i + 1))
+        ids = self.peer_ids
+        rows = list(self.raw_rows(a, b))
+        columns = [[ids[row[1]] for row in rows], [ids[row[2]] for row in rows]]
+        for k in range(3, self.fields):
+            columns.append([number(row[k]) for row in rows])
+        return self.batch_class(*columns)
+
+
+def table_paths(path):
+    return (path + ".downloads", path + ".uploads")
+
+
+def write_meta(path, history):
+    """Write the JSON part of a spilled history."""
+    meta = {"version": FORMAT_VERSION,
+            "peer_ids": history.peer_ids,
+            "upload_rates": history.upload_rates,
+            "rounds": history.last_round() + 1,
+            "round_done": history.round_done,
+            "budget_violations": history.budget_violations,
+            "uploaded": history.uploaded,
+            "downloaded": history.downloaded,
+            "downloaded_from": history.downloaded_from}
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f, sort_keys=True)
+    os.rename(tmp, path)
+
+
+class SpilledHistory:
+    """
+    A finished history file, read through memory mappings.  Has what the
+    Stats functions use from a History.
+    """
+    def __init__(self, path):
+        with open(path) as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError("Unknown history file version: %s" % path)
+        self.path = path
+        # str, not the unicode Python 2's json gives, like a History's
+        self.peer_ids = [str(pid) for pid in meta["peer_ids"]]
+        self.upload_rates = meta["upload_rates"]
+        self.rounds = meta["rounds"]
+        self.round_done = meta["round_done"]
+        self.budget_violations = dict(
+            (pid, [tuple(v) for v in vs])
+            for (pid, vs) in meta["budget_violations"].items())
+        self.uploaded = meta["uploaded"]
+        self.downloaded = meta["downloaded"]
+        self.downloaded_from = meta["downloaded_from"]
+        self.timings = None
+        (dl_path, ul_path) = table_paths(path)
+        self.download_table = SpillTable(dl_path, DOWNLOAD_RECORD, 2,
+                                         self.peer_ids)
+        self.upload_table = SpillTable(ul_path, UPLOAD_RECORD, 1,
+                                       self.peer_ids)
+
+    def close(self):
+        self.download_table.close()
+        self.upload_table.close()
+
+    def last_round(self):
+        return self.rounds - 1
+
+    def download_rows(self, start=None, end=None, peer=None, source=None):
+        """
+        (round, from_id, to_id, piece, blocks) for the downloads in rounds
+        start up to (not including) end, to peer and from source if given.
+        """
+        return self.download_table.rows(start, end, peer, source)
+
+    def upload_rows(self, start=None, end=None, peer=None, source=None):
+        """
+        (round, from_id, to_id, bw) for the uploads in rounds start up to
+        (not including) end, to peer and from source if given.
+        """
+        return self.upload_table.rows(start, end, peer, source)
+
+
+def main(args):
+    """Print the stats for a spilled history: historyfile.py PATH"""
+    from stats import Stats
+    if len(args) != 2:
+        sys.stderr.write("Usage: %s PATH\n" % args[0])
+        sys.exit(2)
+    h = SpilledHistory(args[1])
+    print("Rounds: %d" % h.rounds)
+    print("Uploaded blocks:\n%s" % Stats.uploaded_blocks_str(h.peer_ids, h))
+    print("Completion rounds:\n%s" % Stats.completion_rounds_str(h.peer_ids, h))
+    print("All done round: %s" % Stats.all_done_round(h.peer_ids, h))
+    h.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,51 +1,259 @@
 #!/usr/bin/python
 
-class Upload:
+class Upload(object):
+    __slots__ = ("from_id", "to_id", "bw")
+
     def __init__(self, from_id, to_id, up_bw):
         self.from_id = from_id
         self.to_id = to_id
         self.bw = up_bw
 
+    def __reduce__(self):
+        return (Upload, (self.from_id, self.to_id, self.bw))
+
     def __repr__(self):
         return "Upload(from_id = %s, to_id=%s, bw=%d)" % (
             self.from_id, self.to_id, self.bw)
 
-class Request:
+class Request(object):
+    __slots__ = ("requester_id", "peer_id", "piece_id", "start")
+
     def __init__(self, requester_id, peer_id, piece_id, start):
         self.requester_id = requester_id
         self.peer_id = peer_id   # peer data is requested from
         self.piece_id = piece_id
         self.start = start  # the block index
 
+    def __reduce__(self):
+        return (Request, (self.requester_id, self.peer_id, self.piece_id,
+                          self.start))
+
     def __repr__(self):
         return "Request(requester_id=%s, peer_id=%s, piece_id=%d, start=%d)" % (
             self.requester_id, self.peer_id, self.piece_id, self.start)
 
-class Download:
+class Download(object):
     """ Not actually a message--just used for accounting and history tracking of
      what is actually downloaded.
     """
+    __slots__ = ("from_id", "to_id", "piece", "blocks")
+
     def __init__(self, from_id, to_id, piece, blocks):
         self.from_id = from_id  # who did the agent download from?
         self.to_id = to_id      # Who downloaded?
         self.piece = piece      # Which piece?
         self.blocks = blocks    # How much did the agent download?
 
+    def __reduce__(self):
+        return (Download, (self.from_id, self.to_id, self.piece, self.blocks))
+
     def __repr__(self):
         return "Download(from_id=%s, to_id=%s, piece=%d, blocks=%d)" % (
             self.from_id, self.to_id, self.piece, self.blocks)
 
 
+class MessageBatch(object):
+    """
+    A list of messages kept as one list per field, so a round's worth of
+    them doesn't need an object each.  Indexing and iterating make
+    message objects on the fly, so a batch can stand in for a list of
+    messages: it can be sliced, concatenated (with another batch of the
+    same kind, or a list), appended to, extended and sorted, and it
+    compares equal to a list of the same messages.  Messages are matched
+    by their fields.
+    """
+    __slots__ = ()
+    fields = ()      # names of the column lists, in constructor order
+    message = None   # class of one message
+
+    def __init__(self, *columns):
+        if not columns:
+            columns = [[] for _ in self.fields]
+        for (name, column) in zip(self.fields, columns):
+            setattr(self, name, column)
+
+    @classmethod
+    def from_list(cls, messages):
+        """Build a batch from a list of message objects."""
+        return cls(*[[getattr(m, attr) for m in messages]
+                     for attr in cls.attrs])
+
+    def columns(self):
+        return [getattr(self, name) for name in self.fields]
+
+    def well_formed(self):
+        """True if every column is the same length."""
+        n = len(self)
+        return all(len(c) == n for c in self.columns())
+
+    def rows(self):
+        """Each message as a tuple of its fields."""
+        return zip(*self.columns())
+
+    def __len__(self):
+        return len(getattr(self, self.fields[0]))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.__class__(*[c[i] for c in self.columns()])
+        return self.message(*[c[i] for c in self.columns()])
+
+    def __iter__(self):
+        for row in self.rows():
+            yield self.message(*row)
+
+    def row_of(self, message):
+        return tuple(getattr(message, attr) for attr in self.attrs)
+
+    def as_batch(self, other):
+        """other as a batch like this one, or None if it can't be."""
+        if isinstance(other, self.__class__):
+            return other
+        if (isinstance(other, (list, tuple)) and
+            all(isinstance(m, self.message) for m in other)):
+            return self.from_list(other)
+        return None
+
+    def append(self, message):
+        for (column, value) in zip(self.columns(), self.row_of(message)):
+            column.append(value)
+
+    def extend(self, messages):
+        for message in list(messages):
+            self.append(message)
+
+    def sort(self, key=None, reverse=False):
+        """Sort in place, like list.sort on the messages."""
+        rows = [self.row_of(m)
+                for m in sorted(self, key=key, reverse=reverse)]
+        for (k, name) in enumerate(self.fields):
+            setattr(self, name, [row[k] for row in rows])
+
+    def index(self, message):
+        row = self.row_of(message)
+        for (i, r) in enumerate(self.rows()):
+            if r == row:
+                return i
+        raise ValueError("%r is not in batch" % (message,))
+
+    def __contains__(self, message):
+        if not isinstance(message, self.message):
+            return False
+        row = self.row_of(message)
+        return any(r == row for r in self.rows())
+
+    def __add__(self, other):
+        if isinstance(other, self.__class__):
+            return self.__class__(*[list(a) + list(b) for (a, b)
+                                    in zip(self.columns(), other.columns())])
+        if isinstance(other, list):
+            return list(self) + other
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return other + list(self)
+        return NotImplemented
+
+    def __eq__(self, other):
+        other = self.as_batch(other)
+        if other is None:
+            return NotImplemented
+        return list(self.rows()) == list(other.rows())
 
-            
-class PeerInfo:
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (self.__class__, tuple(self.columns()))
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class RequestBatch(MessageBatch):
+    """
+    Requests, as parallel lists.  Agents may return one from requests()
+    instead of a list of Requests:
+
+      batch = RequestBatch()
+      batch.add(self.id, peer_id, piece_id, start)
+    """
+    __slots__ = ("requester_ids", "peer_ids", "piece_ids", "starts")
+    fields = __slots__
+    attrs = ("requester_id", "peer_id", "piece_id", "start")
+    message = Request
+
+    def add(self, requester_id, peer_id, piece_id, start):
+        self.requester_ids.append(requester_id)
+        self.peer_ids.append(peer_id)
+        self.piece_ids.append(piece_id)
+        self.starts.append(start)
+
+
+class UploadBatch(MessageBatch):
+    """Uploads, as parallel lists.  Agents may return one from uploads()."""
+    __slots__ = ("from_ids", "to_ids", "bws")
+    fields = __slots__
+    attrs = ("from_id", "to_id", "bw")
+    message = Upload
+
+    def add(self, from_id, to_id, bw):
+        self.from_ids.append(from_id)
+        self.to_ids.append(to_id)
+        self.bws.append(bw)
+
+
+class DownloadBatch(MessageBatch):
+    """The downloads to one peer in one round, as parallel lists."""
+    __slots__ = ("from_ids", "to_ids", "pieces", "blocks")
+    fields = __slots__
+    attrs = ("from_id", "to_id", "piece", "blocks")
+    message = Download
+
+    def add(self, from_id, to_id, piece, blocks):
+        self.from_ids.append(from_id)
+        self.to_ids.append(to_id)
+        self.pieces.append(piece)
+        self.blocks.append(blocks)
+
+
+def request_batch(requests):
+    """requests as a RequestBatch: either a batch or a list of Requests."""
+    if isinstance(requests, RequestBatch):
+        return requests
+    return RequestBatch.from_list(requests)
+
+
+def upload_batch(uploads):
+    """uploads as an UploadBatch: either a batch or a list of Uploads."""
+    if isinstance(uploads, UploadBatch):
+        return uploads
+    return UploadBatch.from_list(uploads)
+
+
+class PeerInfo(object):
     """
     Only passing peer ids and the pieces they have available to each agent.
     This prevents them from accidentally messing up the state of other agents.
+
+    available_pieces is an immutable PieceSet, and PeerInfo objects can't
+    be changed either, so the sim shares one per peer with every agent.
     """
+    __slots__ = ("id", "available_pieces")
+
     def __init__(self, id, available):
-        self.id = id
-        self.available_pieces = available
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "available_pieces", available)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PeerInfo is read-only")
+
+    def __reduce__(self):
+        return (PeerInfo, (self.id, self.available_pieces))
 
     def __repr__(self):
         return "PeerInfo(id=%s)" % self.id
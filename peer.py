@@ -5,6 +5,26 @@ from messages import Upload, Request
 from util import even_split
 
 class Peer:
+    # Agents can tell the sim when calling them is pointless, and the sim
+    # will skip those calls:
+    #   idle_when_done: requests() returns [] once we have every piece.
+    #   idle_without_requests: uploads() returns [] (and changes no state)
+    #       when no one requested anything from us.
+    idle_when_done = False
+    idle_without_requests = False
+
+    # uploads() gets the requests to us as a RequestBatch (see messages.py)
+    # rather than a list of Requests.  Either way, requests() may return a
+    # RequestBatch or a list of Requests, and uploads() an UploadBatch or
+    # a list of Uploads.
+    request_batches = False
+
+    # How many of the latest rounds of history uploads() and requests()
+    # look at, or None for all of them.  With --bounded-history, the sim
+    # only keeps as many rounds as the agents ask for, and older rounds
+    # can't be looked up.
+    history_window = None
+
     def __init__(self, config, id, init_pieces, up_bandwidth):
         self.conf = config
         self.id = id
@@ -14,9 +34,12 @@ class Peer:
 
         # This is an upper bound on the number of requests to send to
         # each peer -- they can't possibly handle more than this in one round
-        self.max_requests = self.conf.max_up_bw / self.conf.blocks_per_piece + 1
+        self.max_requests = self.conf.max_up_bw // self.conf.blocks_per_piece + 1
         self.max_requests = min(self.max_requests, self.conf.num_pieces)
 
+        # Set by the sim: read-only view of how many peers have each piece
+        self.rarity = None
+
         self.post_init()
 
     def __repr__(self):
@@ -31,6 +54,13 @@ class Peer:
         """
         self.pieces = new_pieces
 
+    def set_rarity(self, rarity):
+        """
+        Called by the sim before the first round with a RarityView of how
+        many peers have each piece.  The view stays up to date by itself.
+        """
+        self.rarity = rarity
+
     def requests(self, peers, history):
         return []
 
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+
+"""
+Immutable sets of piece ids, packed into the bits of one integer.
+
+Bit i is set when piece i is in the set.  Intersections, unions and
+counts are single integer operations, so agents can combine the
+snapshots the sim hands them without copying anything.
+
+A PieceSet stands in for the frozenset of piece ids agents used to be
+given: the operators also take sets and frozensets (on either side), the
+named methods take any iterables, and it compares equal to a set with
+the same ids.  Results are always PieceSets.  (Python 2's sets don't
+defer comparisons to the other side, so compare with the PieceSet on the
+left there.)
+"""
+
+
+def popcount(bits):
+    """Number of set bits in a non-negative int."""
+    return bin(bits).count("1")
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+
+
+class PieceSet(object):
+    """
+    An immutable set of piece ids.  Supports `in`, len(), iteration in
+    increasing piece order, &, |, - and ^, comparisons, and frozenset's
+    methods.
+    """
+    __slots__ = ("bits",)
+
+    def __init__(self, bits=0):
+        object.__setattr__(self, "bits", bits)
+
+    @staticmethod
+    def from_ids(piece_ids):
+        bits = 0
+        for i in piece_ids:
+            bits |= 1 << i
+        return PieceSet(bits)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PieceSet is immutable")
+
+    def __contains__(self, piece_id):
+        return piece_id >= 0 and (self.bits >> piece_id) & 1 == 1
+
+    def __len__(self):
+        return popcount(self.bits)
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def __nonzero__(self):
+        return self.bits != 0
+    __bool__ = __nonzero__
+
+    @staticmethod
+    def of(other):
+        """other as a PieceSet: a PieceSet, or any iterable of piece ids."""
+        if isinstance(other, PieceSet):
+            return other
+        return PieceSet.from_ids(other)
+
+    @staticmethod
+    def operand(other):
+        """
+        The bits of an operator's other side, like set's operators: a
+        PieceSet, set or frozenset.  None for anything else.
+        """
+        if isinstance(other, PieceSet):
+            return other.bits
+        if isinstance(other, (set, frozenset)):
+            try:
+                return PieceSet.from_ids(other).bits
+            except (TypeError, ValueError):
+                return None     # not piece ids
+        return None
+
+    def __and__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return PieceSet(self.bits & bits)
+    __rand__ = __and__
+
+    def __or__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return PieceSet(self.bits | bits)
+    __ror__ = __or__
+
+    def __sub__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return PieceSet(self.bits & ~bits)
+
+    def __rsub__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return PieceSet(bits & ~self.bits)
+
+    def __xor__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return PieceSet(self.bits ^ bits)
+    __rxor__ = __xor__
+
+    def union(self, *others):
+        """Like frozenset.union; others may be any iterables of piece ids."""
+        bits = self.bits
+        for other in others:
+            bits |= PieceSet.of(other).bits
+        return PieceSet(bits)
+
+    def intersection(self, *others):
+        """Like frozenset.intersection, for any iterables of piece ids."""
+        bits = self.bits
+        for other in others:
+            bits &= PieceSet.of(other).bits
+        return PieceSet(bits)
+
+    def difference(self, *others):
+        """Like frozenset.difference, for any iterables of piece ids."""
+        bits = self.bits
+        for other in others:
+            bits &= ~PieceSet.of(other).bits
+        return PieceSet(bits)
+
+    def symmetric_difference(self, other):
+        return PieceSet(self.bits ^ PieceSet.of(other).bits)
+
+    def issubset(self, other):
+        return self.bits & ~PieceSet.of(other).bits == 0
+
+    def issuperset(self, other):
+        return PieceSet.of(other).bits & ~self.bits == 0
+
+    def isdisjoint(self, other):
+        return self.bits & PieceSet.of(other).bits == 0
+
+    def copy(self):
+        return self
+
+    def __le__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return self.bits & ~bits == 0
+
+    def __ge__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return bits & ~self.bits == 0
+
+    def __lt__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return self.bits != bits and self.bits & ~bits == 0
+
+    def __gt__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return self.bits != bits and bits & ~self.bits == 0
+
+    def with_ids(self, piece_ids):
+        """A new PieceSet that also contains piece_ids."""
+        return self | PieceSet.from_ids(piece_ids)
+
+    def __eq__(self, other):
+        bits = PieceSet.operand(other)
+        if bits is None:
+            return NotImplemented
+        return self.bits == bits
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        # Equal to the frozenset of the same ids, so hash like one
+        return hash(frozenset(self))
+
+    def __reduce__(self):
+        return (PieceSet, (self.bits,))
+
+    def __repr__(self):
+        return "PieceSet(%s)" % list(self)
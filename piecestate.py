@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+"""
+Storage for how many blocks of each piece every peer has.
+
+Two engines are available:
+  - PieceState, a dict of Python lists (the default).
+  - NumpyPieceState, a dense (peers x pieces) integer matrix.  Needs numpy.
+
+Both are updated in place once per round through apply(), and both hand
+out plain lists through pieces() so agents see the same thing either way.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PieceState:
+    """peer_id -> list (blocks / piece)"""
+    def __init__(self, peer_ids, initial, blocks_per_piece):
+        """
+        peer_ids: list of peer ids
+        initial: dict : peer_id -> list (blocks / piece) to start with
+        """
+        self.peer_ids = peer_ids[:]
+        self.blocks_per_piece = blocks_per_piece
+        self.state = dict((pid, list(initial[pid])) for pid in peer_ids)
+
+    def __iter__(self):
+        return iter(self.peer_ids)
+
+    def __getitem__(self, peer_id):
+        """Read-only row for peer_id, indexable by piece id."""
+        return self.state[peer_id]
+
+    def pieces(self, peer_id):
+        """Return a fresh list (blocks / piece) that the caller may keep."""
+        return self.state[peer_id][:]
+
+    def apply(self, updates):
+        """
+        updates: list of (peer_id, piece_id, blocks) -- new blocks this round.
+        Each (peer_id, piece_id) pair may appear at most once.
+
+        Adds the blocks in place.  Returns the list of (peer_id, piece_id)
+        pairs that went from fewer than blocks_per_piece blocks to at least
+        that many with these updates.
+        """
+        bpp = self.blocks_per_piece
+        completed = []
+        for (peer_id, piece_id, blocks) in updates:
+            row = self.state[peer_id]
+            old = row[piece_id]
+            row[piece_id] = old + blocks
+            if old < bpp <= row[piece_id]:
+                completed.append((peer_id, piece_id))
+        return completed
+
+    def missing(self, peer_id):
+        """Number of pieces peer_id doesn't have all the blocks of yet."""
+        bpp = self.blocks_per_piece
+        return sum(1 for blocks in self.state[peer_id] if blocks < bpp)
+
+
+class NumpyPieceState:
+    """Same interface as PieceState, kept in a (peers x pieces) matrix."""
+    def __init__(self, peer_ids, initial, blocks_per_piece):
+        if numpy is None:
+            raise ImportError("The numpy engine needs numpy installed.")
+        self.peer_ids = peer_ids[:]
+        self.blocks_per_piece = blocks_per_piece
+        self.row_of = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.matrix = numpy.array([initial[pid] for pid in peer_ids],
+                                  dtype=numpy.int64)
+
+    def __iter__(self):
+        return iter(self.peer_ids)
+
+    def __getitem__(self, peer_id):
+        return self.matrix[self.row_of[peer_id]]
+
+    def pieces(self, peer_id):
+        return self.matrix[self.row_of[peer_id]].tolist()
+
+    def apply(self, updates):
+        if len(updates) == 0:
+            return []
+        rows = numpy.fromiter((self.row_of[u[0]] for u in updates),
+                              dtype=numpy.intp, count=len(updates))
+        cols = numpy.fromiter((u[1] for u in updates),
+                              dtype=numpy.intp, count=len(updates))
+        blocks = numpy.fromiter((u[2] for u in updates),
+                                dtype=numpy.float64, count=len(updates))
+        if self.matrix.dtype.kind == 'i':
+            if numpy.all(blocks == numpy.floor(blocks)):
+                blocks = blocks.astype(numpy.int64)
+            else:
+                # Agents are allowed fractional bandwidth, so pieces can end
+                # up with fractional blocks.  Switch to floats for good.
+                self.matrix = self.matrix.astype(numpy.float64)
+        bpp = self.blocks_per_piece
+        old = self.matrix[rows, cols]
+        new = old + blocks
+        # (row, col) pairs are unique, so a fancy-index store is safe here.
+        self.matrix[rows, cols] = new
+        done = numpy.flatnonzero((old < bpp) & (new >= bpp))
+        return [(self.peer_ids[rows[i]], int(cols[i])) for i in done]
+
+    def missing(self, peer_id):
+        row = self.matrix[self.row_of[peer_id]]
+        return int(numpy.count_nonzero(row < self.blocks_per_piece))
+
+
+ENGINES = {
+    "list": PieceState,
+    "numpy": NumpyPieceState,
+}
+
+
+def make_piece_state(engine, peer_ids, initial, blocks_per_piece):
+    """Build the piece state for the named engine."""
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine: %s" % engine)
+    return ENGINES[engine](peer_ids, initial, blocks_per_piece)
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+"""
+How many peers have each piece, kept up to date by the sim as pieces
+complete, so agents don't each have to recount it every round.
+"""
+
+import heapq
+
+
+class PieceRarity:
+    """Replica count for every piece.  Owned and updated by the sim."""
+    def __init__(self, num_pieces, available):
+        """
+        available: dict : peer_id -> PieceSet of pieces that peer has
+        """
+        self.counts = [0] * num_pieces
+        for pieces in available.values():
+            for piece_id in pieces:
+                self.counts[piece_id] += 1
+
+    def add(self, piece_id):
+        """One more peer has piece_id."""
+        self.counts[piece_id] += 1
+
+    def view(self):
+        return RarityView(self.counts)
+
+
+class RarityView(object):
+    """
+    Read-only access to the sim's replica counts.  The counts are live:
+    during a round they describe who had what at the start of the round.
+    """
+    __slots__ = ("_counts",)
+
+    def __init__(self, counts):
+        self._counts = counts
+
+    def count(self, piece_id):
+        """Number of peers that have all of piece_id."""
+        return self._counts[piece_id]
+
+    __getitem__ = count
+
+    def __len__(self):
+        return len(self._counts)
+
+    def rarest(self, piece_ids, k=None):
+        """
+        Return piece_ids ordered from rarest to most common, or just the
+        k rarest of them.  Pieces with the same count keep the order they
+        had in piece_ids, so shuffle first for random tie-breaking.
+        """
+        key = self._counts.__getitem__
+        if k is None:
+            return sorted(piece_ids, key=key)
+        return heapq.nsmallest(k, piece_ids, key=key)
+
+    def __repr__(self):
+        return "RarityView(%s)" % self._counts
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+
+"""
+Finds agent classes without importing them.
+
+Every *.py file in the agents directory is scanned for class statements,
+and each class that derives from Peer (directly, or through another agent
+class) is recorded with its module.  Agents that live elsewhere on the
+path, or that the scan can't see, can be added with register().
+
+The scan is cached in a JSON file next to the agents, keyed by each
+file's mtime and size, so only files that changed are read again.
+Modules are only imported when a class is first looked up, which
+create_peers does when it instantiates the agents.
+"""
+
+import inspect
+import json
+import os
+import re
+
+CACHE_VERSION = 1
+CACHE_NAME = ".agent_registry.json"
+
+# class Name(Base1, mod.Base2):
+CLASS_RE = re.compile(r"^class\s+(\w+)\s*\(([^)]*)\)\s*:", re.MULTILINE)
+
+
+def scan_source(text):
+    """[[class name, [base names]]] for the top-level classes in text."""
+    return [[name, [b.strip().split(".")[-1] for b in bases.split(",")
+                    if b.strip()]]
+            for (name, bases) in CLASS_RE.findall(text)]
+
+
+class AgentRegistry:
+    def __init__(self, path=None, cache_path=None):
+        """
+        path: directory to scan for agents (default: this one).
+        cache_path: where to keep the scan results, or None for the
+        default; pass False to not cache.
+        """
+        if path is None:
+            path = os.path.dirname(os.path.abspath(__file__))
+        if cache_path is None:
+            cache_path = os.path.join(path, CACHE_NAME)
+        self.path = path
+        self.cache_path = cache_path
+        self.registered = dict()   # class name -> module name
+        self.found = None          # class name -> module name, from the scan
+
+    def register(self, class_name, module_name):
+        """Add an agent class that lives in module_name."""
+        self.registered[class_name] = module_name
+
+    def load_cache(self):
+        if not self.cache_path:
+            return dict()
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            return dict()
+        if cache.get("version") != CACHE_VERSION:
+            return dict()
+        return cache["files"]
+
+    def save_cache(self, files):
+        if not self.cache_path:
+            return
+        tmp = "%s.%d.tmp" % (self.cache_path, os.getpid())
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"version": CACHE_VERSION, "files": files}, f,
+                          indent=1, sort_keys=True)
+            os.rename(tmp, self.cache_path)
+        except (IOError, OSError):
+            pass    # Read-only checkout: just scan every time
+
+    def scan(self):
+        """
+        dict : module name -> [(class name, [base names])] for every
+        module in the directory, reading only the files that changed
+        since the cached scan.
+        """
+        cached = self.load_cache()
+        files = dict()
+        for name in sorted(os.listdir(self.path)):
+            if (not name.endswith(".py") or
+                not os.path.isfile(os.path.join(self.path, name))):
+                continue
+            st = os.stat(os.path.join(self.path, name))
+            stamp = [st.st_mtime, st.st_size]
+            entry = cached.get(name)
+            if entry is None or entry["stamp"] != stamp:
+                with open(os.path.join(self.path, name)) as f:
+                    entry = {"stamp": stamp, "classes": scan_source(f.read())}
+            files[name] = entry
+        if files != cached:
+            self.save_cache(files)
+        return dict((name[:-3], [(c, bases) for (c, bases) in e["classes"]])
+                    for (name, e) in files.items())
+
+    def agents(self):
+        """dict : class name -> module name, for every known agent class."""
+        if self.found is None:
+            bases_of = dict()   # class name -> [(module, bases)]
+            for (module, classes) in self.scan().items():
+                for (c, bases) in classes:
+                    bases_of.setdefault(c, []).append((module, bases))
+
+            # Agents are Peer subclasses, possibly through other agents
+            is_agent = dict()
+            def check(c, seen):
+                if c == "Peer":
+                    return True
+                if c not in bases_of or c in seen:
+                    return False
+                if c not in is_agent:
+                    seen = seen | set([c])
+                    is_agent[c] = any(check(b, seen)
+                                      for (_, bases) in bases_of[c]
+                                      for b in bases)
+                return is_agent[c]
+
+            found = dict()
+            for c in bases_of:
+                if check(c, frozenset()):
+                    modules = [m for (m, _) in bases_of[c]]
+                    # Several copies (see start.py): prefer the module
+                    # named after the class.
+                    found[c] = (c.lower() if c.lower() in modules
+                                else sorted(modules)[0])
+            self.found = found
+        ans = dict(self.found)
+        ans.update(self.registered)
+        return ans
+
+    def classes(self, class_names):
+        """
+        Return a lazy dict : class name -> class for class_names.  Raises
+        ValueError right away if any of them isn't a known agent.
+        """
+        known = self.agents()
+        modules = dict()
+        for c in class_names:
+            if c not in known:
+                raise ValueError("Unknown agent class: %s" % c)
+            modules[c] = known[c]
+        return AgentClasses(modules, self.path)
+
+
+class AgentClasses:
+    """
+    dict-like class name -> class, that imports each module the first
+    time one of its classes is looked up.
+    """
+    def __init__(self, modules, path):
+        self.modules = modules     # class name -> module name
+        self.path = path
+        self.loaded = dict()
+
+    def __getstate__(self):
+        # Classes are looked up again in the unpickling process
+        return {"modules": self.modules, "path": self.path, "loaded": dict()}
+
+    def __getitem__(self, class_name):
+        if class_name not in self.loaded:
+            module = __import__(self.modules[class_name])
+            self.loaded[class_name] = getattr(module, class_name)
+        return self.loaded[class_name]
+
+    def __contains__(self, class_name):
+        return class_name in self.modules
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def __len__(self):
+        return len(self.modules)
+
+    def keys(self):
+        return list(self.modules)
+
+    def source_file(self, class_name):
+        """Path of the class's source, without importing it."""
+        path = os.path.join(self.path, self.modules[class_name] + ".py")
+        if os.path.exists(path):
+            return path
+        # Registered from elsewhere on the path
+        return inspect.getsourcefile(self[class_name])
+
+    def __repr__(self):
+        return repr(sorted(self.modules))
+
+
+# The registry sim.py uses, over the agents next to it.
+registry = AgentRegistry()
+
+
+def register(class_name, module_name):
+    registry.register(class_name, module_name)
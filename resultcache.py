@@ -0,0 +1,185 @@
+#!/usr/bin/python
+
+"""
+On-disk cache of simulation results.
+
+Results are stored under a key built from the config, the seed, and a
+hash of the source of the simulator and of every agent module the config
+loaded, along with every local module those import (peer.py, helpers an
+agent shares with others, ...).  So editing the sim, or an agent or
+anything it imports, invalidates the runs that depend on it, and nothing
+else.  The cache lives in one
+directory, one file per entry, and the least recently used entries are
+evicted once it grows past its size limit.
+"""
+
+import hashlib
+import os
+import re
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Bump when the format of cached results changes.
+CACHE_VERSION = 4
+
+# import a, b.c as d  /  from a.b import c
+IMPORT_RE = re.compile(r"^[ \t]*(?:from[ \t]+([\w.]+)[ \t]+import|"
+                       r"import[ \t]+([\w., \t]+))", re.MULTILINE)
+
+# The simulator; their imports cover the rest of the sim's modules.
+# (Only the agents import peer.py.)
+SIM_SOURCES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+               for name in ("sim.py", "peer.py")]
+
+# Config entries that don't change a run's results.
+NEUTRAL_KEYS = frozenset([
+    "agent_classes",   # stands in for the source hashes below
+    "workers", "engine",
+    "trace", "report", "report_rounds",
+    "checkpoint", "checkpoint_every", "resume",
+    "timings", "timings_json",
+    "bounded_history",   # only changes what's kept, not what happens
+    "spill_history", "progress",
+    "cache_dir", "cache_max_mb",
+])
+
+
+def source_hash(path):
+    """sha1 of an agent's source file."""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def local_imports(path):
+    """
+    Paths of the modules the file at path imports that live next to it.
+    Imports inside functions and try blocks count too; imports by name
+    (__import__) don't.
+    """
+    with open(path) as f:
+        text = f.read()
+    names = []
+    for (from_name, import_names) in IMPORT_RE.findall(text):
+        if from_name:
+            names.append(from_name)
+        else:
+            names.extend(n.split()[0] for n in import_names.split(",")
+                         if n.strip())
+    d = os.path.dirname(os.path.abspath(path))
+    ans = []
+    for name in names:
+        p = os.path.join(d, name.split(".")[0] + ".py")
+        if os.path.isfile(p):
+            ans.append(p)
+    return ans
+
+
+def import_closure(paths):
+    """
+    dict : module name -> path, for the files at paths and every local
+    module they import, directly or not.
+    """
+    ans = dict()
+    todo = [os.path.abspath(p) for p in paths]
+    while todo:
+        p = todo.pop()
+        name = os.path.splitext(os.path.basename(p))[0]
+        if name in ans:
+            continue
+        ans[name] = p
+        todo.extend(local_imports(p))
+    return ans
+
+
+def cacheable(config):
+    """
+    Only seeded, reproducible runs without side outputs can be cached.
+    CPU budgets depend on timing, so runs with them aren't reproducible.
+    """
+    return (config.seed is not None and config.agent_threads <= 1 and
+            not config.budgets and
+            config.trace is None and config.report is None and
+            config.checkpoint is None and config.timings_json is None and
+            config.spill_history is None)
+
+
+def run_key(config):
+    """Cache key for a run of config."""
+    h = hashlib.sha1()
+    h.update(("version=%d\n" % CACHE_VERSION).encode("utf-8"))
+    for (k, v) in sorted(config.items()):
+        if k not in NEUTRAL_KEYS:
+            h.update(("%s=%r\n" % (k, v)).encode("utf-8"))
+    sources = SIM_SOURCES + [config.agent_classes.source_file(name)
+                             for name in sorted(config.agent_classes)]
+    for (name, path) in sorted(import_closure(sources).items()):
+        h.update(("source %s=%s\n" % (name, source_hash(path))
+                  ).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + ".pkl")
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        p = self.entry_path(key)
+        try:
+            with open(p, "rb") as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(p, None)   # mark as recently used
+        return value
+
+    def put(self, key, value):
+        p = self.entry_path(key)
+        # Several processes may share the cache directory
+        tmp = "%s.%d.tmp" % (p, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, p)
+        self.evict()
+
+    def entries(self):
+        """[(mtime, size, path)] for every entry, oldest first."""
+        ans = []
+        for name in os.listdir(self.path):
+            if name.endswith(".pkl"):
+                p = os.path.join(self.path, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue    # evicted by another process
+                ans.append((st.st_mtime, st.st_size, p))
+        return sorted(ans)
+
+    def evict(self):
+        """Drop least recently used entries until under max_bytes."""
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, p) in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Invalidate everything."""
+        for (_, _, p) in self.entries():
+            try:
+                os.remove(p)
+            except OSError:
+                pass
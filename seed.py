@@ -1,18 +1,23 @@
 #!/usr/bin/python
 
 import random
-from messages import Upload, Request
+from messages import Upload
 from util import even_split
 from peer import Peer
 
 class Seed(Peer):
+    idle_when_done = True
+    idle_without_requests = True
+    request_batches = True
+    history_window = 0
+
     def requests(self, peers, history):
         # Seeds don't need anything.
         return []
 
     def uploads(self, requests, peers, history):
         max_upload = 4  # max num of peers to upload to at a time
-        requester_ids = list(set(map(lambda r: r.requester_id, requests)))
+        requester_ids = sorted(set(requests.requester_ids))
 
         n = min(max_upload, len(requester_ids))
         if n == 0:
@@ -8,25 +8,64 @@ Simulates one file being shared amongst a set of peers.  The file is divided int
 The simulation proceeds in rounds.  In each round, peers can request pieces from other peers, and then decide how much to upload to others.  Once every peer has every piece, the simulation ends.
 """
 
-import re
+import os
 import random
 import sys
 import logging
-import copy
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import itertools
 import pprint
 from optparse import OptionParser
 
-from messages import Upload, Request, Download, PeerInfo
+from messages import PeerInfo, RequestBatch, DownloadBatch
 from util import *
 from stats import Stats
+from aggregate import IterationStats
 from history import History
+from piecestate import make_piece_state, ENGINES
+from validation import Validator
+from pieceset import PieceSet
+from rarity import PieceRarity
+from tracesink import TraceSink
+from checkpoint import CheckpointWriter, load_checkpoint
+from resultcache import ResultCache, cacheable, run_key
+from timing import Timings, NoTimings, per_thread_time
+from budget import BudgetEnforcer, parse_budgets
+from registry import registry
+import validation
     
 
 class Sim:
     def __init__(self, config):
         self.config = config
         self.up_bws_state = dict()
+        self.agent_pool = None
+
+    def map_agents(self, f, peers):
+        """
+        Return [f(p) for p in peers].  With more than one agent thread
+        configured, the calls run on a thread pool; either way they have
+        all finished when this returns.
+
+        Threads only help agents that spend their time outside the GIL
+        (waiting on I/O, or in C code that releases it); pure Python
+        agents run no faster.  The calls happen in no particular order,
+        and the agents share the random module, so threaded runs aren't
+        reproducible, even with a seed.
+        """
+        if self.config.agent_threads <= 1:
+            return [f(p) for p in peers]
+        if self.agent_pool is None:
+            self.agent_pool = ThreadPool(self.config.agent_threads)
+        return self.agent_pool.map(f, peers)
+
+    def close(self):
+        """Shut down the agent thread pool, if there is one."""
+        if self.agent_pool is not None:
+            self.agent_pool.close()
+            self.agent_pool.join()
+            self.agent_pool = None
 
     
     def up_bw(self, peer_id, reinit=False):
@@ -37,107 +76,45 @@ class Sim:
         # Re-initialize up-bws if we are starting a new simulation
         if reinit and peer_id in s:
             del s[peer_id]
+        elif peer_id in s:
+            return s[peer_id]
         
         """Sets the upload bandwidth of seeds to max, other agents at random"""
-        if re.match("Seed",peer_id): the_up_bw = c.max_up_bw
+        if peer_id.startswith("Seed"): the_up_bw = c.max_up_bw
         else: the_up_bw = random.randint(c.min_up_bw, c.max_up_bw)
         
-        return s.setdefault(peer_id, the_up_bw)
+        s[peer_id] = the_up_bw
+        return the_up_bw
 
-    def run_sim_once(self):
+    def run_sim_once(self, iteration=0):
         """Return a history"""
         conf = self.config
         # Keep track of the current round.  Needs to be in scope for helpers.
         round = 0  
 
-        def check_pred(pred, msg, Exc, lst):
-            """Check if any element of lst matches the predicate.  If it does,
-            raise an exception of type Exc, including the msg and the offending
-            element."""
-            m = map(pred, lst)
-            if True in m:
-                i = m.index(True)
-                raise Exc(msg + " Bad element: %s" % lst[i])
-
-        def check_uploads(peer, uploads):
-            """Raise an IllegalUpload exception if there is a problem."""
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalUpload, uploads)
-
-            not_upload = lambda o: not isinstance(o, Upload)
-            check(not_upload, "List of Uploads contains non-Upload object.")
-
-            self_upload = lambda upload: upload.to_id == peer.id
-            check(self_upload, "Can't upload to yourself.")
-            
-            not_from_self = lambda upload: upload.from_id != peer.id
-            check(not_from_self, "Upload.from != peer id.")
-
-            check(lambda u: u.bw < 0, "Upload bandwidth must be non-negative!")
-
-            limit = self.up_bw(peer.id)
-            if sum(map(lambda u: u.bw, uploads)) > limit:
-                raise IllegalUpload("Can't upload more than limit of %d. %s" % (
-                    limit, uploads))
-
-            # If we got here, looks ok.
-
-        def check_requests(peer, requests, peer_pieces, available):
-            """Raise an IllegalRequest exception if there is a problem."""
-
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalRequest, requests)
-
-            check(lambda o: not isinstance(o, Request),
-                  "List of Requests contains non-Request object.")
-
-            bad_piece_id = lambda r: (r.piece_id < 0 or
-                                      r.piece_id >= self.config.num_pieces)
-            check(bad_piece_id, "Request asks for non-existent piece!")
-            
-            bad_peer_id = lambda r: r.peer_id not in self.peer_ids
-            check(bad_peer_id, "Request mentions non-existent peer!")
-
-            bad_requester_id = lambda r: r.requester_id != peer.id
-            check(bad_requester_id, "Request has wrong peer id!")
-
-            bad_start_block = lambda r: (
-                r.start < 0 or
-                r.start >= self.config.blocks_per_piece or
-                r.start > peer_pieces[peer.id][r.piece_id])
-            # Must request the _next_ necessary block
-            check(bad_start_block, "Request has bad start block!")
-
-            def piece_peer_does_not_have(r):
-                other_peer = self.peers_by_id[r.peer_id]
-                return r.piece_id not in available[other_peer.id]
-            check(piece_peer_does_not_have, "Asking for piece peer does not have!")
-            
-            # If we got here, looks ok
-
         def available_pieces(peer_id, peer_pieces):
             """
             Return a list of piece ids that this peer has available.
             """
-            return filter(lambda i: peer_pieces[peer_id][i] == conf.blocks_per_piece,
-                          range(conf.num_pieces))
-
-        def peer_done(peer_pieces, peer_id):
-            # TODO: remove linear pass
-            for blocks_so_far in peer_pieces[peer_id]:
-                if blocks_so_far < conf.blocks_per_piece:
-                    return False
-            return True
-            
-        def all_done(peer_pieces):
-            result = True
-            # Check all peers to update done status
-            for peer_id in peer_pieces:
-                if peer_done(peer_pieces, peer_id):
+            return [i for i in range(conf.num_pieces)
+                    if peer_pieces[peer_id][i] == conf.blocks_per_piece]
+
+        def update_done(finished):
+            """
+            finished: list of (peer_id, piece_id) pieces completed this round.
+
+            Update the per-peer count of missing pieces and the set of
+            peers that still need something.  Returns the list of peers
+            that finished this round.
+            """
+            done = []
+            for (peer_id, piece_id) in finished:
+                missing[peer_id] -= 1
+                if missing[peer_id] == 0:
+                    active.discard(peer_id)
                     history.peer_is_done(round, peer_id)
-                else:
-                    result = False
-            return result
+                    done.append(peer_id)
+            return done
 
         def create_peers():
             """Each agent class must be already loaded, and have a
@@ -148,18 +125,7 @@ class Sim:
                 agent_class = conf.agent_classes[class_name]
                 return agent_class(*params)
 
-            counts = dict()
-            def index(name):
-                if name in counts:
-                    a = counts[name]
-                    counts[name] += 1
-                else:
-                    a = 0
-                    counts[name] = 1
-                return a
-
-            n = len(conf.agent_class_names)
-            ids = map(lambda n: "%s%d" % (n,index(n)), conf.agent_class_names)
+            ids = make_peer_ids(conf.agent_class_names)
 
             is_seed = lambda id: id.startswith("Seed")
 
@@ -179,64 +145,113 @@ class Sim:
             up_bws = [self.up_bw(id, reinit=True) for id in ids] 
             params = zip(r(conf), ids, pieces, up_bws)
 
-            peers = map(load, conf.agent_class_names, params)
+            peers = list(map(load, conf.agent_class_names, params))
             #logging.debug("Peers: \n" + "\n".join(str(p) for p in peers))
             return peers, peer_pieces
 
+        def make_history(peers, upload_rates):
+            windows = None
+            if conf.bounded_history:
+                windows = dict((p.id, p.history_window) for p in peers)
+            history = History(self.peer_ids, upload_rates, windows)
+            if conf.spill_history is not None:
+                # Keep in memory as many rounds as any agent looks at
+                keep = max([1] + [p.history_window for p in peers
+                                  if p.history_window is not None])
+                history.spill(iteration_path(conf.spill_history, iteration,
+                                             conf.iters), keep)
+            return history
+
+        def agent_call(p, phase, f, *args):
+            """Call one of p's methods, timed and held to p's budget."""
+            if budgets is None:
+                return timings.agent_call(p, f, *args)
+            return budgets.call(round, p, phase, timings.agent_call, p, f, *args)
+
         def get_peer_requests(p, peer_info, peer_history, peer_pieces, available):
             def remove_me(info):
                 # TODO: Do we need this linear pass?
-                return filter(lambda peer: peer.id != p.id, peer_info)
+                return [peer for peer in peer_info if peer.id != p.id]
 
-            pieces = copy.copy(peer_pieces[p.id])
+            pieces = peer_pieces.pieces(p.id)
             # Made copy of pieces and the peer info this peer needs to make it's
             # decision, so that it can't change the simulation's copies.
             p.update_pieces(pieces)
-            rs = p.requests(remove_me(peer_info), peer_history)
-            check_requests(p, rs, peer_pieces, available)
-            return rs
+            return agent_call(p, "requests", p.requests, remove_me(peer_info),
+                              peer_history)
+
+        def index_requests(requests):
+            """
+            Bucket this round's (already checked) requests by the peer being
+            asked, in a single pass.  Returns (by_target, by_pair):
+
+            by_target: dict : peer_id -> RequestBatch of requests to peer_id
+            by_pair: dict : requester_id -> (dict : peer_id -> [indexes into
+                     requests[requester_id]])
 
-        def get_peer_uploads(all_requests, p, peer_info, peer_history):
+            Requests keep the order they were made in within each bucket.
+            """
+            by_target = dict((pid, RequestBatch()) for pid in self.peer_ids)
+            by_pair = dict()
+            for requester_id, rs in requests.items():
+                to_peer = by_pair[requester_id] = dict()
+                for (i, peer_id) in enumerate(rs.peer_ids):
+                    by_target[peer_id].add(requester_id, peer_id,
+                                           rs.piece_ids[i], rs.starts[i])
+                    if peer_id in to_peer:
+                        to_peer[peer_id].append(i)
+                    else:
+                        to_peer[peer_id] = [i]
+            return (by_target, by_pair)
+
+        def get_peer_uploads(requests_by_target, p, peer_info, peer_history):
             def remove_me(info):
                 # TODO: remove this pass?  Use a set?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            def requests_to(id):
-                f = lambda r: r.peer_id == id
-                ans = []
-                for rs in all_requests.values():
-                    ans.extend(filter(f, rs))
-                return ans
+                return [peer for peer in peer_info if peer.id != p.id]
 
-            requests = requests_to(p.id)
+            requests = requests_by_target[p.id]
+            if not p.request_batches:
+                requests = list(requests)
 
-            us = p.uploads(requests, remove_me(peer_info), peer_history)
-            check_uploads(p, us)
-            return us
+            return agent_call(p, "uploads", p.uploads, requests,
+                              remove_me(peer_info), peer_history)
 
         def upload_rate(uploads, uploader_id, requester_id):
             """
             return the uploading rate from uploader to requester
             in blocks per time period, or 0 if not uploading.
             """
-            for u in uploads[uploader_id]:
-                if u.to_id == requester_id:
-                    return u.bw
-            return 0
-
-        def update_peer_pieces(peer_pieces, requests, uploads, available):
+            us = uploads[uploader_id]
+            try:
+                return us.bws[us.to_ids.index(requester_id)]
+            except ValueError:
+                return 0
+
+        def update_peer_pieces(peer_pieces, requests, requests_by_pair, uploads,
+                               available):
             """
             Process the uploads: figure out how many blocks of all the requested
             pieces the requesters ended up with.
             Make sure requesting the same thing from lots of peers doesn't
             stack.
             update the sets of available pieces as needed.
+
+            peer_pieces is updated in place, all at once, after every
+            requester's downloads have been worked out.
+
+            Returns (downloads, finished), where downloads is a dict :
+            peer_id -> DownloadBatch, and finished lists the (peer_id,
+            piece_id) pieces that were completed this round.
             """
-            downloads = dict()  # peer_id -> [downloads]
-            new_pp = copy.deepcopy(peer_pieces)
-            for requester_id in requests:
-                downloads[requester_id] = list()
-            for requester_id in requests:
+            downloads = dict()  # peer_id -> DownloadBatch
+            new_blocks = []     # [(peer_id, piece_id, blocks)]
+            bpp = conf.blocks_per_piece
+            for requester_id in requests_by_pair:
+                downloads[requester_id] = DownloadBatch()
+            for requester_id in requests_by_pair:
+                rs = requests[requester_id]
+                piece_ids = rs.piece_ids
+                starts = rs.starts
                 # Keep track of how many blocks of each piece this
                 # requester got.  piece -> (blocks, from_who)
                 new_blocks_per_piece = dict()
@@ -248,151 +263,495 @@ class Sim:
                     else:
                         new_blocks_per_piece[piece_id] = (blocks, peer_id)
 
-                # Group the requests by peer that is being asked
-                get_peer_id = lambda r: r.peer_id
-                rs = sorted(requests[requester_id], key=get_peer_id)
-                for peer_id, rs_for_peer in itertools.groupby(rs, get_peer_id):
+                # Requests are already grouped by the peer being asked
+                to_peer = requests_by_pair[requester_id]
+                for peer_id in sorted(to_peer):
+                    rs_for_peer = to_peer[peer_id]
                     bw = upload_rate(uploads, peer_id, requester_id)
                     if bw == 0:
                         continue
                     # This bandwidth gets applied in order to each piece requested
-                    for r in rs_for_peer:
-                        needed_blocks = conf.blocks_per_piece - r.start
+                    for i in rs_for_peer:
+                        needed_blocks = bpp - starts[i]
                         alloced_bw = min(bw, needed_blocks)
-                        update_count(r.piece_id, alloced_bw, peer_id)
+                        update_count(piece_ids[i], alloced_bw, peer_id)
                         bw -= alloced_bw
                         if bw == 0:
                             break
                 for piece_id in new_blocks_per_piece:
                     (blocks, peer_id) = new_blocks_per_piece[piece_id]
-                    new_pp[requester_id][piece_id] += blocks
-                    if new_pp[requester_id][piece_id] == conf.blocks_per_piece:
-                        available[requester_id].add(piece_id)
-                    d = Download(peer_id, requester_id, piece_id, blocks)
-                    downloads[requester_id].append(d)
+                    new_blocks.append((requester_id, piece_id, blocks))
+                    downloads[requester_id].add(peer_id, requester_id,
+                                                piece_id, blocks)
+
+            finished = peer_pieces.apply(new_blocks)
+            # Gather each peer's new pieces as bits, then swap in one new
+            # snapshot per peer; the old one may still be held by agents.
+            new_bits = dict()
+            for (requester_id, piece_id) in finished:
+                if peer_pieces[requester_id][piece_id] == conf.blocks_per_piece:
+                    new_bits[requester_id] = (new_bits.get(requester_id, 0) |
+                                              (1 << piece_id))
+                    rarity.add(piece_id)
+            for (requester_id, bits) in new_bits.items():
+                available[requester_id] = PieceSet(
+                    available[requester_id].bits | bits)
                 
-            return (new_pp, downloads)
+            return (downloads, finished)
 
         def completed_pieces(peer_id, available):
             return len(available[peer_id])
         
         def log_peer_info(peer_pieces, available):
-            for p_id in self.peer_ids:
-                pieces = peer_pieces[p_id]
-                logging.debug("pieces for %s: %s" % (str(p_id), str(pieces)))
+            root_logger = logging.getLogger()
+            if root_logger.isEnabledFor(logging.DEBUG):
+                for p_id in self.peer_ids:
+                    pieces = peer_pieces.pieces(p_id)
+                    logging.debug("pieces for %s: %s", p_id, pieces)
+            if not root_logger.isEnabledFor(logging.INFO):
+                return
             log = ", ".join("%s:%s" % (p_id, completed_pieces(p_id, available))
                             for p_id in self.peer_ids)
-            logging.info("Pieces completed: " + log)
-
-
-        logging.debug("Starting simulation with config: %s" % str(conf))
+            logging.info("Pieces completed: %s", log)
+
+
+        def snapshot(stopped):
+            """Everything a checkpoint needs, besides the history's rounds."""
+            offsets = dict(trace=None, report=None)
+            if trace is not None:
+                trace.flush()
+                offsets["trace"] = trace.f.tell()
+            if report is not None:
+                report.flush()
+                offsets["report"] = report.tell()
+            return dict(round=round, stopped=stopped, peers=peers,
+                        peer_pieces=peer_pieces, available=available,
+                        rarity=rarity, missing=missing, active=active,
+                        validator=validator, up_bws=self.up_bws_state,
+                        round_done=history.round_done, budgets=budgets,
+                        random_state=random.getstate(),
+                        trace_offset=offsets["trace"],
+                        report_offset=offsets["report"])
+
+        logging.debug("Starting simulation with config: %s", conf)
+
+        checkpoint_path = None
+        if conf.checkpoint is not None:
+            checkpoint_path = iteration_path(conf.checkpoint, iteration,
+                                             conf.iters)
+        resume = None
+        if (conf.resume and checkpoint_path is not None and
+            os.path.exists(checkpoint_path)):
+            resume = load_checkpoint(checkpoint_path)
+
+        if resume is None:
+            stopped = False
+            peers, initial_pieces = create_peers()
+            self.peer_ids = [p.id for p in peers]
+            peer_pieces = make_piece_state(conf.engine, self.peer_ids,
+                                           initial_pieces, conf.blocks_per_piece)
+
+            upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
+            history = make_history(peers, upload_rates)
+            validator = Validator(conf.validation, self.peer_ids, upload_rates,
+                                  conf.num_pieces, conf.blocks_per_piece,
+                                  conf.validation_sample, conf.seed)
+            budgets = None
+            if conf.budgets:
+                budgets = BudgetEnforcer(conf.budgets, history.budget_violations)
+
+            # dict : pid -> PieceSet(finished / available pieces).  The
+            # PieceSets are immutable, so agents can be handed them directly.
+            available = dict((pid, PieceSet.from_ids(available_pieces(pid, peer_pieces)))
+                             for pid in self.peer_ids)
+            # How many peers have each piece.  Agents get a read-only view.
+            rarity = PieceRarity(conf.num_pieces, available)
+            rarity_view = rarity.view()
+            for p in peers:
+                p.set_rarity(rarity_view)
+
+            # peer_id -> number of pieces still missing, and the peers that
+            # aren't done yet.  Both are only touched as pieces complete.
+            missing = dict((pid, peer_pieces.missing(pid)) for pid in self.peer_ids)
+            active = set(pid for pid in self.peer_ids if missing[pid] > 0)
+            for pid in self.peer_ids:
+                if missing[pid] == 0:
+                    history.peer_is_done(round, pid)
+            trace_offset = report_offset = None
+        else:
+            (state, rounds) = resume
+            round = state["round"]
+            stopped = state["stopped"]
+            peers = state["peers"]
+            peer_pieces = state["peer_pieces"]
+            available = state["available"]
+            rarity = state["rarity"]
+            missing = state["missing"]
+            active = state["active"]
+            validator = state["validator"]
+            self.up_bws_state = state["up_bws"]
+            self.peer_ids = [p.id for p in peers]
+
+            upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
+            history = make_history(peers, upload_rates)
+            for (dls, ups) in rounds:
+                history.update(dls, ups)
+            history.round_done = state["round_done"]
+            budgets = state["budgets"]
+            if budgets is not None:
+                history.budget_violations = budgets.violations
+            random.setstate(state["random_state"])
+            trace_offset = state["trace_offset"]
+            report_offset = state["report_offset"]
+            logging.info("Resuming from %s at round %d", checkpoint_path, round)
 
-        peers, peer_pieces = create_peers()
-        self.peer_ids = [p.id for p in peers]
         self.peers_by_id = dict((p.id, p) for p in peers)
-        
-        upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
-        history = History(self.peer_ids, upload_rates)
-
-        # dict : pid -> set(finished / available pieces)
-        available = dict((pid, set(available_pieces(pid, peer_pieces)))
-                         for pid in self.peer_ids)
+        if budgets is not None:
+            budgets.start()
+
+        # pid -> PeerInfo, rebuilt only when the peer's pieces change
+        info_by_id = dict((pid, PeerInfo(pid, available[pid]))
+                          for pid in self.peer_ids)
+
+        trace = None
+        if conf.trace is not None:
+            trace = TraceSink(iteration_path(conf.trace, iteration, conf.iters),
+                              offset=trace_offset)
+            if trace_offset is None:
+                trace.start(self.peer_ids, upload_rates,
+                            [pid for pid in self.peer_ids if missing[pid] == 0])
+
+        # The download report is streamed out as each round finishes.
+        report = None
+        if conf.report is not None:
+            report_path = iteration_path(conf.report, iteration, conf.iters)
+            if report_offset is None:
+                report = open(report_path, "w")
+                report.write("History\n")
+            else:
+                report = open(report_path, "r+")
+                report.seek(report_offset)
+                report.truncate()
+        (report_start, report_end) = conf.report_rounds
+
+        timings = Timings() if conf.timings else NoTimings()
+
+        checkpoints = None
+        if checkpoint_path is not None:
+            journal_size = resume[0]["journal_size"] if resume else 0
+            checkpoints = CheckpointWriter(checkpoint_path, journal_size)
 
         # Begin the event loop
-        while True:
-            logging.info("======= Round %d ========" % round)
-
-            peer_info = [PeerInfo(p.id, available[p.id])
-                         for p in peers]
-            requests = dict()  # peer_id -> list of Requests
-            uploads = dict()   # peer_id -> list of Uploads
-            h = dict()
+        while not stopped:
+            logging.info("======= Round %d ========", round)
+
+            peer_info = [info_by_id[p.id] for p in peers]
+            requests = dict()  # peer_id -> RequestBatch
+            uploads = dict()   # peer_id -> UploadBatch
+            h = dict((p.id, history.peer_history(p.id)) for p in peers)
+
+            # Every request only depends on the round-start state, and every
+            # upload only on the full set of requests, so each phase can be
+            # spread over the agent pool.  map_agents is the barrier.
+            # Agents that have said they'd have nothing to do aren't called.
+            requesters = [p for p in peers
+                          if p.id in active or not p.idle_when_done]
+            t = timings.start()
+            rs = self.map_agents(
+                lambda p: get_peer_requests(p, peer_info, h[p.id], peer_pieces,
+                                            available),
+                requesters)
             for p in peers:
-                h[p.id] = history.peer_history(p.id)
-                requests[p.id] = get_peer_requests(p, peer_info, h[p.id], peer_pieces,
-                                                   available)
-
+                requests[p.id] = []
+            for (p, r) in zip(requesters, rs):
+                requests[p.id] = r
+            timings.end("requests", t)
+            t = timings.start()
+            batches = validator.check_requests(requests, peer_pieces,
+                                               available)
+            timings.end("request_validation", t)
+
+            t = timings.start()
+            for pid in requests:
+                requests[pid] = batches[pid]
+            (requests_by_target, requests_by_pair) = index_requests(requests)
+
+            uploaders = [p for p in peers
+                         if requests_by_target[p.id] or
+                         not p.idle_without_requests]
+            us = self.map_agents(
+                lambda p: get_peer_uploads(requests_by_target, p,
+                                           peer_info, h[p.id]),
+                uploaders)
             for p in peers:
-                uploads[p.id] = get_peer_uploads(requests, p, peer_info, h[p.id])
-                
-
-            (peer_pieces, downloads) = update_peer_pieces(
-                peer_pieces, requests, uploads, available)
+                uploads[p.id] = []
+            for (p, u) in zip(uploaders, us):
+                uploads[p.id] = u
+            timings.end("uploads", t)
+            t = timings.start()
+            batches = validator.check_uploads(uploads)
+            timings.end("upload_validation", t)
+
+            t = timings.start()
+            for pid in uploads:
+                uploads[pid] = batches[pid]
+            (downloads, finished) = update_peer_pieces(
+                peer_pieces, requests, requests_by_pair, uploads, available)
+            for pid in set(pid for (pid, _) in finished):
+                info_by_id[pid] = PeerInfo(pid, available[pid])
+            newly_done = update_done(finished)
+            timings.end("transfer", t)
+
+            t = timings.start()
             history.update(downloads, uploads)
+            if checkpoints is not None:
+                checkpoints.add_round(downloads, uploads)
+            timings.end("history", t)
 
-            logging.debug(history.pretty_for_round(round))
+            t = timings.start()
+            if trace is not None:
+                trace.round(round, self.peer_ids, downloads, uploads,
+                            newly_done)
+
+            logging.debug("%s", lazy_str(history.pretty_for_round, round))
+            if (report is not None and report_start <= round and
+                (report_end is None or round <= report_end)):
+                history.write_round(report, round)
 
             log_peer_info(peer_pieces, available)
-           
-            if all_done(peer_pieces):
+            if conf.progress and round % conf.progress == 0:
+                logging.warning("%s", Stats.progress_str(self.peer_ids, history))
+            timings.end("logging", t)
+
+            if len(active) == 0:
                 logging.info("All done!")                    
+                stopped = True
                 break
             round += 1
             if round > conf.max_round:
                 logging.info("Out of time.  Stopping.")
+                stopped = True
                 break
-
-        logging.info("Game history:\n%s" % history.pretty())
+            if (checkpoints is not None and
+                round % conf.checkpoint_every == 0):
+                checkpoints.save(snapshot(False))
+
+        if budgets is not None:
+            budgets.close()
+
+        if checkpoints is not None:
+            # A final checkpoint lets a resumed run skip straight here.
+            checkpoints.save(snapshot(True))
+            checkpoints.close()
+
+        history.close()
+        if trace is not None:
+            trace.end(history.last_round() + 1)
+            trace.close()
+        if report is not None:
+            report.close()
+
+        if conf.timings:
+            timings.rounds = history.last_round() + 1
+            history.timings = timings
+            if conf.timings_json is not None:
+                timings.write_json(iteration_path(conf.timings_json,
+                                                  iteration, conf.iters))
+            logging.info("Timings:\n%s", lazy_str(timings.pretty))
+
+        logging.info("Game history:\n%s", lazy_str(history.pretty))
 
         logging.info("======== STATS ========")
-        logging.info("Uploaded blocks:\n%s" %
-                     Stats.uploaded_blocks_str(self.peer_ids, history))
-        logging.info("Completion rounds:\n%s" %
-                     Stats.completion_rounds_str(self.peer_ids, history))
-        logging.info("All done round: %s" %
-                     Stats.all_done_round(self.peer_ids, history))
+        logging.info("Uploaded blocks:\n%s",
+                     lazy_str(Stats.uploaded_blocks_str, self.peer_ids, history))
+        logging.info("Completion rounds:\n%s",
+                     lazy_str(Stats.completion_rounds_str, self.peer_ids, history))
+        logging.info("All done round: %s",
+                     lazy_str(Stats.all_done_round, self.peer_ids, history))
+        if budgets is not None:
+            logging.info("Budget violations:\n%s",
+                         lazy_str(Stats.budget_violations_str, self.peer_ids,
+                                  history))
 
         return history
 
+    def iteration_seeds(self):
+        """
+        Return the random seed to use for each iteration.  Without a seed
+        in the config, serial runs aren't seeded at all; pooled runs pick a
+        base seed so that each worker still gets its own.
+        """
+        c = self.config
+        base = c.seed
+        if base is None:
+            if c.workers <= 1:
+                return [None] * c.iters
+            base = random.randint(0, sys.maxsize)
+        return [base + i for i in range(c.iters)]
+
+    def run_iteration(self, iteration, seed):
+        """
+        Run one simulation, seeding the random module first if seed isn't
+        None.  Returns the per-iteration summary:
+        (uploaded blocks dict, completion rounds dict)
+        """
+        if seed is not None:
+            random.seed(seed)
+        # Only the summary outlives this call, not the history
+        history = self.run_sim_once(iteration)
+        return (Stats.uploaded_blocks(self.peer_ids, history),
+                Stats.completion_rounds(self.peer_ids, history))
+
+    def run_iterations(self):
+        """
+        Run config.iters simulations, in a process pool if config.workers
+        is more than 1.  Returns an aggregate.IterationStats with every
+        iteration's summary folded in, in order.  If config.cache_dir is
+        set, reproducible runs are looked up in and saved to the result
+        cache there.
+        """
+        c = self.config
+        self.peer_ids = make_peer_ids(c.agent_class_names)
+        if c.agent_threads > 1 and c.seed is not None:
+            logging.warning("--agent-threads %d: agent calls run in no "
+                            "fixed order, so --seed won't reproduce this run",
+                            c.agent_threads)
+        if c.cache_dir is None or not cacheable(c):
+            return self.compute_iterations()
+        cache = ResultCache(c.cache_dir, c.cache_max_mb * 1024 * 1024)
+        key = run_key(c)
+        stats = cache.get(key)
+        if stats is not None:
+            logging.info("Using cached results %s", key)
+            return stats
+        stats = self.compute_iterations()
+        cache.put(key, stats)
+        return stats
+
+    def compute_iterations(self):
+        """Run the iterations for run_iterations(), without the cache."""
+        c = self.config
+        seeds = self.iteration_seeds()
+        stats = IterationStats(self.peer_ids)
+        if c.workers <= 1:
+            try:
+                for (i, seed) in enumerate(seeds):
+                    stats.add(self.run_iteration(i, seed))
+                return stats
+            finally:
+                self.close()
+        pool = multiprocessing.Pool(c.workers)
+        try:
+            # imap() hands the results back in iteration order, so they're
+            # folded in the same order as a serial run, and the stats
+            # don't depend on which worker finished first.
+            for summary in pool.imap(run_iteration_in_worker,
+                                     [(c, i, seed)
+                                      for (i, seed) in enumerate(seeds)]):
+                stats.add(summary)
+            return stats
+        finally:
+            pool.close()
+            pool.join()
+
     def run_sim(self):
-        histories = map(lambda i: self.run_sim_once(), 
-                        range(self.config.iters))
+        iteration_stats = self.run_iterations()
         logging.warning("======== SUMMARY STATS ========")
-        
-        uploaded_blocks = map(
-            lambda h: Stats.uploaded_blocks(self.peer_ids, h),
-            histories)
-        completion_rounds = map(
-            lambda h: Stats.completion_rounds(self.peer_ids, h),
-            histories)
-
-        def extract_by_peer_id(lst, peer_id):
-            """Given a list of dicts, pull out the entry
-            for peer_id from each dict.  Return a list"""
-            return map(lambda d: d[peer_id], lst)
-
-        uploaded_by_id = dict(
-            (p_id, extract_by_peer_id(uploaded_blocks, p_id))
-            for p_id in self.peer_ids)
-
-        completion_by_id = dict(
-            (p_id, extract_by_peer_id(completion_rounds, p_id))
-            for p_id in self.peer_ids)
+
+        stats = iteration_stats.stats()
 
         logging.warning("Uploaded blocks: avg (stddev)")
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: mean(uploaded_by_id[id])):
-            us = uploaded_by_id[p_id]
-            logging.warning("%s: %.1f  (%.1f)" % (p_id, mean(us), stddev(us)))
+        for p_id in sorted(self.peer_ids, key=lambda id: stats[id][0]):
+            (up_mean, up_stddev, _, _) = stats[p_id]
+            logging.warning("%s: %.1f  (%.1f)" % (p_id, up_mean, up_stddev))
 
         logging.warning("Completion rounds: avg (stddev)")
+        for p_id in sorted(self.peer_ids, key=lambda id: none_first(stats[id][2])):
+            (_, _, c_mean, c_stddev) = stats[p_id]
+            logging.warning("%s: %s  (%s)" % (p_id, c_mean, c_stddev))
 
-        def optionize(f):
-            def g(lst):
-                if None in lst:
-                    return None
-                else:
-                    return f(lst)
-            return g
+        def fmt(x):
+            return "-" if x is None else "%.1f" % x
 
-        opt_mean = optionize(mean)
-        opt_stddev = optionize(stddev)
-        
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: opt_mean(completion_by_id[id])):
-            cs = completion_by_id[p_id]
-            logging.warning("%s: %s  (%s)" % (p_id, opt_mean(cs), opt_stddev(cs)))
+        logging.warning("Uploaded blocks: p10 / median / p90")
+        for p_id in sorted(self.peer_ids, key=lambda id: stats[id][0]):
+            (up, _) = iteration_stats.quantiles(p_id)
+            logging.warning("%s: %s" % (p_id, " / ".join(map(fmt, up))))
+
+        logging.warning("Completion: rate, rounds p10 / median / p90")
+        for p_id in sorted(self.peer_ids, key=lambda id: none_first(stats[id][2])):
+            (_, cs) = iteration_stats.quantiles(p_id)
+            logging.warning("%s: %.0f%%, %s" % (
+                p_id, 100 * iteration_stats.completion_rate(p_id),
+                " / ".join(map(fmt, cs))))
+
+
+def summarize(peer_ids, summaries):
+    """
+    summaries: [(uploaded blocks dict, completion rounds dict)], one pair
+    per iteration, as returned by Sim.run_iteration.
+
+    Returns dict: peer_id -> (uploaded mean, uploaded stddev,
+                              completion mean, completion stddev)
+    The completion stats are None if the peer didn't finish every time.
+    See aggregate.IterationStats for folding in summaries one at a time.
+    """
+    stats = IterationStats(peer_ids)
+    for summary in summaries:
+        stats.add(summary)
+    return stats.stats()
+
+
+def run_iteration_in_worker(args):
+    """Pool entry point: args is (config, iteration, seed)."""
+    (config, iteration, seed) = args
+    sim = Sim(config)
+    try:
+        return sim.run_iteration(iteration, seed)
+    finally:
+        sim.close()
+
+
+def iteration_path(path, iteration, iters):
+    """
+    With more than one iteration, each one gets its own output file:
+    path.0, path.1, ...
+    """
+    if iters > 1:
+        return "%s.%d" % (path, iteration)
+    return path
+
+
+def parse_round_range(s):
+    """
+    "A:B" -> (A, B), rounds A through B inclusive.  Either end may be left
+    off ("A:" or ":B"), and a single number "A" means just round A.
+    End None means no limit.
+    """
+    if ":" not in s:
+        return (int(s), int(s))
+    (start, end) = s.split(":", 1)
+    start = int(start) if start else 0
+    end = int(end) if end else None
+    return (start, end)
+
+
+def make_peer_ids(agent_class_names):
+    """
+    Number the agents of each class in order: ["Seed", "Dummy", "Seed"]
+    becomes ["Seed0", "Dummy0", "Seed1"].
+    """
+    counts = dict()
+    def index(name):
+        if name in counts:
+            a = counts[name]
+            counts[name] += 1
+        else:
+            a = 0
+            counts[name] = 1
+        return a
 
+    return ["%s%d" % (n, index(n)) for n in agent_class_names]
 
 
 def configure_logging(loglevel):
@@ -429,15 +788,16 @@ def parse_agents(args):
             
         
 
-def main(args):
-    usage_msg = "Usage:  %prog [options] PeerClass1[,count] PeerClass2[,count] ..."
+def make_parser(usage_msg=None):
+    """The command line options, shared with sweep.py and friends."""
+    if usage_msg is None:
+        usage_msg = "Usage:  %prog [options] PeerClass1[,count] PeerClass2[,count] ..."
     parser = OptionParser(usage=usage_msg)
 
-    def usage(msg):
-        print "Error: %s\n" % msg
-        parser.print_help()
-        sys.exit()
-    
+    parser.add_option("--list-agents",
+                      dest="list_agents", default=False, action="store_true",
+                      help="List the agent classes that can be run, and exit")
+
     parser.add_option("--loglevel",
                       dest="loglevel", default="info",
                       help="Set the logging level: 'debug' or 'info'")
@@ -466,9 +826,209 @@ def main(args):
                       dest="iters", default=1, type="int",
                       help="Number of times to run simulation to get stats")
 
+    parser.add_option("--seed",
+                      dest="seed", default=None, type="int",
+                      help="Random seed; iteration i is seeded with seed+i")
+
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to run iterations in")
+
+    parser.add_option("--agent-threads",
+                      dest="agent_threads", default=1, type="int",
+                      help="Threads to run each round's agent calls on "
+                      "(default 1).  The calls run in no particular order "
+                      "and share the random module, so runs with more than "
+                      "one thread aren't reproducible, even with --seed.  "
+                      "Only helps agents that release the GIL (I/O, C "
+                      "code); pure Python agents are no faster")
+
+    parser.add_option("--bounded-history",
+                      dest="bounded_history", default=False,
+                      action="store_true",
+                      help="Only keep as many rounds of history as the agents "
+                      "say they look at (their history_window), so memory "
+                      "doesn't grow with the number of rounds")
+
+    parser.add_option("--progress",
+                      dest="progress", default=0, type="int",
+                      help="Log how many peers are done and how much has been "
+                      "downloaded every N rounds (0 for never)")
+
+    parser.add_option("--spill-history",
+                      dest="spill_history", default=None,
+                      help="Write the history to this file (and FILE.downloads, "
+                      "FILE.uploads) as the run goes, instead of keeping it "
+                      "in memory; see historyfile.py.  FILE.i for iteration "
+                      "i when --iters > 1")
+
+    parser.add_option("--validation",
+                      dest="validation", default="full",
+                      help="How much to check agents' requests and uploads "
+                      "against the rules: 'full', 'sampled' or 'off'.  "
+                      "Types, ids and ranges are always checked")
+
+    parser.add_option("--validation-sample",
+                      dest="validation_sample", default=0.1, type="float",
+                      help="Fraction of peers checked each round when "
+                      "--validation is 'sampled'")
+
+    parser.add_option("--trace",
+                      dest="trace", default=None,
+                      help="Write a newline-delimited JSON record of each "
+                      "round to this file (FILE.i for iteration i when "
+                      "--iters > 1)")
+
+    parser.add_option("--report",
+                      dest="report", default=None,
+                      help="Stream the round-by-round download report to "
+                      "this file (FILE.i for iteration i when --iters > 1)")
+
+    parser.add_option("--report-rounds",
+                      dest="report_rounds", default=":",
+                      help="Only report these rounds: 'A:B', 'A:', ':B' or 'A'")
+
+    parser.add_option("--checkpoint",
+                      dest="checkpoint", default=None,
+                      help="Save the simulation state to this file as it "
+                      "runs (FILE.i for iteration i when --iters > 1)")
+
+    parser.add_option("--checkpoint-every",
+                      dest="checkpoint_every", default=100, type="int",
+                      help="Rounds between checkpoints")
+
+    parser.add_option("--resume",
+                      dest="resume", default=False, action="store_true",
+                      help="Carry on from the --checkpoint file if it exists")
+
+    parser.add_option("--engine",
+                      dest="engine", default="list",
+                      help="Piece state storage: 'list' or 'numpy'")
+
+    parser.add_option("--timings",
+                      dest="timings", default=False, action="store_true",
+                      help="Time each phase of the round loop and each "
+                      "agent's calls")
+
+    parser.add_option("--timings-json",
+                      dest="timings_json", default=None,
+                      help="Write the --timings results to this JSON file "
+                      "(FILE.i for iteration i when --iters > 1).  "
+                      "Implies --timings")
+
+    parser.add_option("--budget",
+                      dest="budget", default=[], action="append",
+                      help="CPU budget for an agent class: "
+                      "Class=CALL_MS[:RUN_MS], for each requests() / "
+                      "uploads() call and for the whole run; either may be "
+                      "left empty.  Class '*' covers classes without their "
+                      "own.  Over-budget calls count as doing nothing.  "
+                      "Before Python 3.7, can't be used with "
+                      "--agent-threads.  Repeatable")
+
+    parser.add_option("--cache-dir",
+                      dest="cache_dir", default=None,
+                      help="Reuse the results of earlier seeded runs with the "
+                      "same options and agent code, kept in this directory")
+
+    parser.add_option("--cache-max-mb",
+                      dest="cache_max_mb", default=256, type="int",
+                      help="Size limit of the --cache-dir; the least "
+                      "recently used results are dropped past it")
+
+    parser.add_option("--clear-cache",
+                      dest="clear_cache", default=False, action="store_true",
+                      help="Empty the --cache-dir before running")
+
+    return parser
+
+
+def make_config(options, agents_to_run):
+    """
+    Build the sim config from parsed options and a list of agent class
+    names.  Raises ValueError if the options don't make sense.
+    """
+    if options.workers < 1:
+        raise ValueError("--workers must be at least 1")
+    if options.agent_threads < 1:
+        raise ValueError("--agent-threads must be at least 1")
+    if options.validation not in validation.LEVELS:
+        raise ValueError("Unknown validation level: %s" % options.validation)
+    try:
+        report_rounds = parse_round_range(options.report_rounds)
+    except ValueError:
+        raise ValueError("Bad round range: %s" % options.report_rounds)
+    if options.checkpoint_every < 1:
+        raise ValueError("--checkpoint-every must be at least 1")
+    if options.resume and options.checkpoint is None:
+        raise ValueError("--resume needs --checkpoint")
+    if options.engine not in ENGINES:
+        raise ValueError("Unknown engine: %s" % options.engine)
+    budgets = parse_budgets(options.budget)
+    if budgets and options.agent_threads > 1 and not per_thread_time:
+        # One agent would be charged for every thread's CPU time
+        raise ValueError("--budget with --agent-threads needs Python 3.7+ "
+                         "to time each thread; use --agent-threads 1")
+    if options.progress < 0:
+        raise ValueError("--progress can't be negative")
+    if options.cache_max_mb < 1:
+        raise ValueError("--cache-max-mb must be at least 1")
+    if options.clear_cache and options.cache_dir is None:
+        raise ValueError("--clear-cache needs --cache-dir")
+
+    config = Params()
+
+    config.add("agent_class_names", agents_to_run)
+    # Checks the classes exist now, but only imports them when the
+    # agents are created.
+    config.add("agent_classes", registry.classes(config.agent_class_names))
+
+    
+    config.add("num_pieces", options.num_pieces)
+    config.add("blocks_per_piece",options.blocks_per_piece)
+    config.add("max_round", options.max_round)
+    config.add("min_up_bw", options.min_up_bw)
+    config.add("max_up_bw", options.max_up_bw)
+    config.add("iters", options.iters)
+    config.add("engine", options.engine)
+    config.add("seed", options.seed)
+    config.add("workers", options.workers)
+    config.add("agent_threads", options.agent_threads)
+    config.add("validation", options.validation)
+    config.add("bounded_history", options.bounded_history)
+    config.add("spill_history", options.spill_history)
+    config.add("progress", options.progress)
+    config.add("validation_sample", options.validation_sample)
+    config.add("trace", options.trace)
+    config.add("report", options.report)
+    config.add("report_rounds", report_rounds)
+    config.add("checkpoint", options.checkpoint)
+    config.add("checkpoint_every", options.checkpoint_every)
+    config.add("resume", options.resume)
+    config.add("budgets", budgets)
+    config.add("timings", options.timings or options.timings_json is not None)
+    config.add("timings_json", options.timings_json)
+    config.add("cache_dir", options.cache_dir)
+    config.add("cache_max_mb", options.cache_max_mb)
+    return config
 
+
+def main(args):
+    parser = make_parser()
+
+    def usage(msg):
+        print("Error: %s\n" % msg)
+        parser.print_help()
+        sys.exit()
+    
     (options, args) = parser.parse_args()
 
+    if options.list_agents:
+        agents = registry.agents()
+        for name in sorted(agents):
+            print("%s (%s.py)" % (name, agents[name]))
+        return
+
     # leftover args are class names, with optional counts:
     # "Peer Seed[,4]"
 
@@ -478,23 +1038,19 @@ def main(args):
     else:
         try:
             agents_to_run = parse_agents(args)
-        except ValueError, e:
+        except ValueError as e:
             usage(e)
     
+    try:
+        config = make_config(options, agents_to_run)
+    except ValueError as e:
+        usage(e)
+
     configure_logging(options.loglevel)
-    config = Params()
 
-    config.add("agent_class_names", agents_to_run)
-    config.add("agent_classes", load_modules(config.agent_class_names))
+    if options.clear_cache:
+        ResultCache(options.cache_dir, 0).clear()
 
-    
-    config.add("num_pieces", options.num_pieces)
-    config.add("blocks_per_piece",options.blocks_per_piece)
-    config.add("max_round", options.max_round)
-    config.add("min_up_bw", options.min_up_bw)
-    config.add("max_up_bw", options.max_up_bw)
-    config.add("iters", options.iters)
-    
     sim = Sim(config)
     sim.run_sim()
 
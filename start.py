@@ -6,7 +6,7 @@ import shutil
 
 def main(args):
     if len(args) != 2:
-        print "Usage: start.py TEAMNAME"
+        print("Usage: start.py TEAMNAME")
         sys.exit(1)
 
     teamname = args[1].lower()
@@ -17,10 +17,10 @@ def main(args):
     
     for f in files:
         dst = "%s%s.py" % (teamname, f)
-        print "Copying %s to %s..." % (src, dst)
+        print("Copying %s to %s..." % (src, dst))
         shutil.copyfile(src, dst)
 
-    print "All done.  Code away!"
+    print("All done.  Code away!")
 
 if __name__ == "__main__":
     main(sys.argv)
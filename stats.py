@@ -1,5 +1,7 @@
 #!/usr/bin/python
 
+from util import none_first
+
 class Stats:
     @staticmethod
     def uploaded_blocks(peer_ids, history):
@@ -9,15 +11,30 @@ class Stats:
 
         Returns:
         dict: peer_id -> total upload blocks used
+
+        Only uploads to peers in peer_ids count.  For every peer, that's
+        the History's running total.
         """
+        if set(peer_ids) == set(history.peer_ids):
+            return dict((peer_id, history.uploaded[peer_id])
+                        for peer_id in peer_ids)
         uploaded = dict((peer_id, 0) for peer_id in peer_ids)
-        for peer_id in peer_ids:
-            for ds in history.downloads[peer_id]:
-                for download in ds:
-                    uploaded[download.from_id] += download.blocks
-                
+        for to_id in peer_ids:
+            for (from_id, blocks) in history.downloaded_from[to_id].items():
+                uploaded[from_id] += blocks
         return uploaded
 
+    @staticmethod
+    def downloaded_blocks(peer_ids, history):
+        """Returns dict: peer_id -> total blocks downloaded"""
+        return dict((peer_id, history.downloaded[peer_id])
+                    for peer_id in peer_ids)
+
+    @staticmethod
+    def downloaded_from(peer_id, history):
+        """Returns dict: source peer_id -> blocks peer_id downloaded from it"""
+        return dict(history.downloaded_from[peer_id])
+
     @staticmethod
     def uploaded_blocks_str(peer_ids, history):
         """ Return a pretty stringified version of uploaded_blocks """
@@ -43,9 +60,8 @@ class Stats:
         """ Return a pretty stringified version of completion_rounds """
         d = Stats.completion_rounds(peer_ids, history)
 
-        k = lambda id: d[id]
         return "\n".join("%s: %s" % (id, d[id])
-                         for id in sorted(d.keys(), key=d.__getitem__))
+                         for id in sorted(d.keys(), key=lambda id: none_first(d[id])))
 
     @staticmethod
     def all_done_round(peer_ids, history):
@@ -54,3 +70,22 @@ class Stats:
             return None
         return max(d.values())
     
+
+    @staticmethod
+    def progress_str(peer_ids, history):
+        """One line on how the sim is going so far."""
+        done = len([id for id in peer_ids if id in history.round_done])
+        return "Round %d: %d/%d peers done, %d blocks downloaded" % (
+            history.last_round(), done, len(peer_ids),
+            sum(history.downloaded[id] for id in peer_ids))
+
+    @staticmethod
+    def budget_violations(peer_ids, history):
+        """Returns dict: peer_id -> number of times over its CPU budget"""
+        return dict((id, len(history.budget_violations[id])) for id in peer_ids)
+
+    @staticmethod
+    def budget_violations_str(peer_ids, history):
+        """ Return a pretty stringified version of budget_violations """
+        d = Stats.budget_violations(peer_ids, history)
+        return "\n".join("%s: %d" % (id, d[id]) for id in peer_ids)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+"""
+Runs the simulation over a grid of configurations in one process pool.
+
+Any sim.py option can be varied with --grid, using its option name
+(dashes or underscores) and a comma-separated list of values; flags
+take true / false (--grid bounded-history=false,true), and --budget one
+spec per value.  The agent
+mix is varied with --grid "agents=Seed,2 GlazStd,3;Seed,1 GlazTyrant,4"
+(mixes separated by ';').  Every combination is run, by a pool of worker
+processes that stay up for the whole sweep, so interpreter startup and
+module loading are only paid once per worker.
+
+The results are written as one tab-separated table, with a row per
+(configuration, peer):
+
+  python sweep.py --iters 5 --grid num-pieces=10,20 --grid max-bw=8,16 \
+      --sweep-workers 4 --out results.tsv Seed,2 GlazStd,4
+
+Per-run output files (--trace, --report, --checkpoint, --spill-history,
+--timings-json) get one per grid point, numbered in the table's row
+order: --trace t.ndjson writes t.ndjson.point0, t.ndjson.point1, ...
+"""
+
+import copy
+import itertools
+import logging
+import multiprocessing
+import sys
+
+from sim import (Sim, make_parser, make_config, parse_agents,
+                 configure_logging)
+from resultcache import ResultCache
+
+# Options naming a file each run writes
+OUTPUT_OPTIONS = ("trace", "report", "checkpoint", "spill_history",
+                  "timings_json")
+
+# Options that can't differ between grid points, and why
+UNSWEPT = {
+    "workers": "each point runs its iterations in one process; "
+               "see --sweep-workers",
+    "loglevel": "logging is set up once for the whole sweep",
+    "list_agents": "it doesn't run anything",
+    "clear_cache": "the cache is cleared once, before the sweep",
+    "grid": "it's the sweep itself",
+    "sweep_workers": "it's the sweep itself",
+    "out": "it's the sweep itself",
+}
+
+BOOLEANS = {"true": True, "yes": True, "on": True, "1": True,
+            "false": False, "no": False, "off": False, "0": False}
+
+
+def parse_bool(s):
+    try:
+        return BOOLEANS[s.strip().lower()]
+    except KeyError:
+        raise ValueError("Not true or false: %s" % s)
+
+
+def parse_grid(parser, specs):
+    """
+    specs: list of "name=v1,v2,..." strings.
+    Returns a list of (dest, [values]) with values converted the way the
+    matching sim option would be: by its type, true / false for flags,
+    and a list of one value for options that can be repeated.  'agents'
+    values are lists of agent class names.  Raises ValueError for
+    options that can't be swept.
+    """
+    def key(name):
+        return name.strip().lstrip("-").replace("-", "_")
+
+    # Accept both the option name (max-bw) and its dest (max_up_bw)
+    dests = dict()
+    options = dict()
+    for o in parser.option_list:
+        if o.dest:
+            options[o.dest] = o
+            dests[o.dest] = o.dest
+            for opt in o._long_opts:
+                dests[key(opt)] = o.dest
+    convert = {"int": int, "float": float, "string": str, None: str}
+
+    def converter(o):
+        if o.action in ("store_true", "store_false"):
+            return parse_bool
+        f = convert[o.type]
+        if o.action == "append":
+            return lambda v: [f(v)]
+        return f
+
+    grid = []
+    for spec in specs:
+        if "=" not in spec:
+            raise ValueError("Bad --grid argument: %s" % spec)
+        (name, values) = spec.split("=", 1)
+        if key(name) == "agents":
+            grid.append(("agents", [parse_agents(mix.split())
+                                    for mix in values.split(";")]))
+        else:
+            if key(name) not in dests:
+                raise ValueError("Unknown option in --grid: %s" % name)
+            dest = dests[key(name)]
+            if dest in UNSWEPT:
+                raise ValueError("Can't vary %s in --grid: %s" % (
+                    name, UNSWEPT[dest]))
+            f = converter(options[dest])
+            grid.append((dest, [f(v) for v in values.split(",")]))
+    return grid
+
+
+def grid_points(grid):
+    """Every combination of grid values, as a list of dicts."""
+    names = [name for (name, _) in grid]
+    return [dict(zip(names, combo))
+            for combo in itertools.product(*[vals for (_, vals) in grid])]
+
+
+def point_path(path, index, num_points):
+    """
+    With more than one grid point, each one gets its own output file:
+    path.point0, path.point1, ...
+    """
+    if num_points > 1:
+        return "%s.point%d" % (path, index)
+    return path
+
+
+def point_config(options, agents_to_run, point, index, num_points):
+    """The sim config for grid point number index."""
+    opts = copy.copy(options)
+    agents = point.get("agents", agents_to_run)
+    for (name, value) in point.items():
+        if name != "agents":
+            setattr(opts, name, value)
+    # Points run at the same time, so they can't share output files
+    for name in OUTPUT_OPTIONS:
+        if name not in point and getattr(opts, name) is not None:
+            setattr(opts, name,
+                    point_path(getattr(opts, name), index, num_points))
+    # Each sweep worker runs its iterations itself; pool workers
+    # can't start pools of their own.
+    opts.workers = 1
+    return make_config(opts, agents)
+
+
+def run_point(config):
+    """
+    Worker entry point.  Runs one configuration and returns
+    (peer ids, dict : peer_id -> summary stats + (completion rate,)).
+    """
+    sim = Sim(config)
+    iteration_stats = sim.run_iterations()
+    stats = iteration_stats.stats()
+    return (sim.peer_ids,
+            dict((p_id, stats[p_id] + (iteration_stats.completion_rate(p_id),))
+                 for p_id in sim.peer_ids))
+
+
+def agents_str(agent_class_names):
+    """["Seed", "Seed", "GlazStd"] -> "Seed,2 GlazStd", as on the command line."""
+    parts = []
+    for (name, group) in itertools.groupby(agent_class_names):
+        n = len(list(group))
+        parts.append(name if n == 1 else "%s,%d" % (name, n))
+    return " ".join(parts)
+
+
+def write_table(f, grid, points, results):
+    """Write one row per (grid point, peer) to the file-like f."""
+    names = [name for (name, _) in grid]
+    header = names + ["peer", "uploaded_mean", "uploaded_stddev",
+                      "completion_mean", "completion_stddev",
+                      "completion_rate"]
+    f.write("\t".join(header) + "\n")
+    for (point, (peer_ids, stats)) in zip(points, results):
+        values = []
+        for name in names:
+            v = point[name]
+            values.append(agents_str(v) if name == "agents" else str(v))
+        for p_id in peer_ids:
+            row = values + [p_id] + [str(x) for x in stats[p_id]]
+            f.write("\t".join(row) + "\n")
+
+
+def main(args):
+    parser = make_parser(
+        "Usage:  %prog [sim options] [--grid name=v1,v2 ...] "
+        "PeerClass1[,count] ...")
+    parser.add_option("--grid",
+                      dest="grid", default=[], action="append",
+                      help="Vary an option: name=v1,v2,...  Use "
+                      "'agents=mix1;mix2' to vary the agents.  Repeatable")
+    parser.add_option("--sweep-workers",
+                      dest="sweep_workers", default=multiprocessing.cpu_count(),
+                      type="int",
+                      help="Number of worker processes for the sweep")
+    parser.add_option("--out",
+                      dest="out", default=None,
+                      help="Write the results table here (default: stdout)")
+    parser.set_defaults(loglevel="warning")
+
+    def usage(msg):
+        print("Error: %s\n" % msg)
+        parser.print_help()
+        sys.exit(1)
+
+    (options, args) = parser.parse_args(args[1:])
+    if options.sweep_workers < 1:
+        usage("--sweep-workers must be at least 1")
+    try:
+        agents_to_run = parse_agents(args) if args else ['Dummy', 'Dummy', 'Seed']
+        grid = parse_grid(parser, options.grid)
+        points = grid_points(grid)
+        configs = [point_config(options, agents_to_run, point, i, len(points))
+                   for (i, point) in enumerate(points)]
+    except ValueError as e:
+        usage(e)
+
+    configure_logging(options.loglevel)
+    if options.clear_cache:
+        ResultCache(options.cache_dir, 0).clear()
+    logging.warning("Running %d configurations on %d workers",
+                    len(configs), options.sweep_workers)
+
+    if options.sweep_workers == 1:
+        results = [run_point(c) for c in configs]
+    else:
+        pool = multiprocessing.Pool(options.sweep_workers)
+        try:
+            results = pool.map(run_point, configs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    if options.out is None:
+        write_table(sys.stdout, grid, points, results)
+    else:
+        with open(options.out, "w") as f:
+            write_table(f, grid, points, results)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+import bench
+
+
+def result(name, rate, **fields):
+    r = {"name": name, "rounds_per_sec": rate, "peak_mb": 10.0}
+    r.update(fields)
+    return r
+
+
+def compare(results, baseline):
+    out = sys.stdout
+    try:
+        sys.stdout = open(os.devnull, "w")
+        return bench.compare(results, {"results": baseline}, 0.1)
+    finally:
+        sys.stdout.close()
+        sys.stdout = out
+
+
+class CompareTest(unittest.TestCase):
+    def test_matches_same_interpreter_however_started(self):
+        this = bench.interpreter()
+        baseline = [result("a", 100.0, interpreter=this),
+                    result("a", 50.0, interpreter="PyPy 3.10",
+                           python="pypy3")]
+        # --interpreters sets python to a path; the interpreter still matches
+        self.assertEqual(compare([result("a", 60.0, interpreter=this,
+                                         python="/usr/bin/python3")],
+                                 baseline), ["a"])
+        self.assertEqual(compare([result("a", 60.0, interpreter="PyPy 3.10")],
+                                 baseline), [])
+
+    def test_old_baseline_matched_by_name(self):
+        baseline = [result("a", 100.0), result("b", 100.0)]
+        self.assertEqual(compare([result("a", 50.0, python="python3",
+                                         interpreter="CPython 3.11"),
+                                  result("b", 100.0)], baseline), ["a"])
+
+    def test_no_match(self):
+        baseline = [result("a", 100.0, interpreter="CPython 2.7")]
+        self.assertEqual(compare([result("a", 1.0, interpreter="CPython 3.11"),
+                                  result("c", 1.0)], baseline), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
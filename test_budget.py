@@ -0,0 +1,93 @@
+import signal
+import time
+import unittest
+
+import timing
+from budget import BudgetEnforcer, OverBudget
+from sim import make_config, make_parser
+from timing import thread_time
+
+
+class Agent(object):
+    """Stands in for a peer; the budget goes by class name."""
+    def __init__(self, id):
+        self.id = id
+
+
+def spin(seconds):
+    end = thread_time() + seconds
+    while thread_time() < end:
+        pass
+
+
+def catches_exception():
+    # Like the agents that guard their logic with `except Exception`
+    try:
+        spin(2.0)
+    except Exception:
+        pass
+    return ["late"]
+
+
+def bare_except():
+    # Swallows everything, then keeps working for a while
+    for _ in range(50):
+        try:
+            spin(0.01)
+        except:
+            pass
+    return ["late"]
+
+
+def quick():
+    return ["ok"]
+
+
+@unittest.skipUnless(hasattr(signal, "setitimer"), "needs setitimer")
+class BudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.violations = {"a": []}
+        self.budgets = BudgetEnforcer({"Agent": (0.05, None)},
+                                      self.violations)
+        self.budgets.start()
+
+    def tearDown(self):
+        self.budgets.close()
+
+    def test_not_swallowed_by_except_exception(self):
+        self.assertFalse(issubclass(OverBudget, Exception))
+        start = time.time()
+        ans = self.budgets.call(0, Agent("a"), "requests", catches_exception)
+        self.assertEqual(ans, [])
+        self.assertTrue(time.time() - start < 1.0)
+        self.assertEqual(self.violations["a"], [(0, "requests", "call")])
+
+    def test_bare_except_still_over_budget(self):
+        ans = self.budgets.call(3, Agent("a"), "uploads", bare_except)
+        self.assertEqual(ans, [])
+        self.assertEqual(self.violations["a"], [(3, "uploads", "call")])
+
+    def test_within_budget(self):
+        self.assertEqual(self.budgets.call(0, Agent("a"), "requests", quick),
+                         ["ok"])
+        self.assertEqual(self.violations["a"], [])
+
+
+class ThreadsTest(unittest.TestCase):
+    def config(self, args):
+        (options, _) = make_parser().parse_args(args)
+        return make_config(options, ["Seed", "Dummy"])
+
+    def test_budget_with_threads_needs_thread_time(self):
+        args = ["--budget", "Dummy=5", "--agent-threads", "2"]
+        if timing.per_thread_time:
+            self.assertEqual(self.config(args).budgets,
+                             {"Dummy": (0.005, None)})
+        else:
+            self.assertRaises(ValueError, self.config, args)
+        self.config(["--budget", "Dummy=5"])
+        self.config(["--agent-threads", "2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
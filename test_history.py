@@ -0,0 +1,70 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from historyfile import SpilledHistory, table_paths, DOWNLOAD_RECORD
+from sim import Sim, make_parser, make_config, configure_logging
+
+
+def run(args, seed=1):
+    (options, _) = make_parser().parse_args(
+        ["--num-pieces", "10", "--max-round", "40"] + args)
+    config = make_config(options, ["Seed", "Dummy", "Dummy", "GlazStd"])
+    configure_logging("warning")
+    random.seed(seed)
+    return Sim(config).run_sim_once()
+
+
+class SpillTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "h")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_spill_file_complete_while_history_alive(self):
+        in_memory = run([])
+        spilled = run(["--spill-history", self.path])
+        expected = list(in_memory.download_rows())
+        self.assertTrue(expected)
+        (dl_path, _) = table_paths(self.path)
+        self.assertEqual(os.path.getsize(dl_path),
+                         len(expected) * DOWNLOAD_RECORD.size)
+        # spilled is still alive, with its files open for reading
+        h = SpilledHistory(self.path)
+        try:
+            self.assertEqual(list(h.download_rows()), expected)
+            self.assertEqual(list(h.upload_rows()),
+                             list(in_memory.upload_table.rows()))
+        finally:
+            h.close()
+        self.assertEqual(list(spilled.download_rows()), expected)
+
+    def test_same_row_types_in_memory_and_spilled(self):
+        def types(rows):
+            return [tuple(type(x).__name__ for x in row) for row in rows]
+        in_memory = run([])
+        spilled = run(["--spill-history", self.path])
+        h = SpilledHistory(self.path)
+        try:
+            self.assertEqual(types(in_memory.download_rows()),
+                             types(h.download_rows()))
+            self.assertEqual(types(in_memory.upload_table.rows()),
+                             types(h.upload_rows()))
+            self.assertEqual(types(spilled.download_rows()),
+                             types(h.download_rows()))
+        finally:
+            h.close()
+
+    def test_close_twice(self):
+        h = run(["--spill-history", self.path])
+        h.close()
+        self.assertEqual(SpilledHistory(self.path).rounds,
+                         h.last_round() + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import pickle
+import unittest
+
+from messages import (Download, DownloadBatch, Request, RequestBatch,
+                      Upload, UploadBatch)
+
+
+def downloads():
+    return DownloadBatch(["a", "b", "c"], ["x", "x", "x"], [0, 1, 2],
+                         [3, 1, 2])
+
+
+def fields(messages):
+    return [(m.from_id, m.to_id, m.piece, m.blocks) for m in messages]
+
+
+class MessageBatchTest(unittest.TestCase):
+    def test_index(self):
+        b = downloads()
+        self.assertEqual(fields([b[0], b[-1]]),
+                         [("a", "x", 0, 3), ("c", "x", 2, 2)])
+
+    def test_slice(self):
+        b = downloads()[0:2]
+        self.assertTrue(isinstance(b, DownloadBatch))
+        self.assertEqual(fields(b), [("a", "x", 0, 3), ("b", "x", 1, 1)])
+        self.assertEqual(len(downloads()[5:]), 0)
+        self.assertEqual(fields(downloads()[::-1]),
+                         list(reversed(fields(downloads()))))
+
+    def test_concatenate(self):
+        b = downloads()
+        both = b + b[:1]
+        self.assertTrue(isinstance(both, DownloadBatch))
+        self.assertEqual(fields(both), fields(b) + fields(b[:1]))
+        self.assertEqual(fields(b + []), fields(b))
+        self.assertEqual(fields([] + b), fields(b))
+        extra = Download("d", "x", 3, 1)
+        self.assertEqual(fields([extra] + b), fields([extra]) + fields(b))
+        self.assertRaises(TypeError, lambda: b + UploadBatch())
+
+    def test_list_methods(self):
+        b = downloads()
+        b.append(Download("d", "x", 3, 5))
+        b.extend([Download("e", "x", 4, 0)])
+        self.assertEqual(len(b), 5)
+        b.sort(key=lambda d: d.blocks, reverse=True)
+        self.assertEqual([d.blocks for d in b], [5, 3, 2, 1, 0])
+        self.assertEqual(b.index(Download("c", "x", 2, 2)), 2)
+        self.assertTrue(Download("c", "x", 2, 2) in b)
+        self.assertFalse(Download("c", "x", 2, 9) in b)
+        self.assertRaises(ValueError, b.index, Download("z", "x", 0, 0))
+        empty = DownloadBatch()
+        empty.sort()
+        self.assertEqual(len(empty), 0)
+
+    def test_equality(self):
+        b = downloads()
+        self.assertEqual(b, downloads())
+        self.assertEqual(b, list(b))
+        self.assertEqual(DownloadBatch(), [])
+        self.assertNotEqual(b, b[1:])
+        self.assertNotEqual(RequestBatch(), UploadBatch())
+
+    def test_batch_kinds(self):
+        r = RequestBatch()
+        r.add("p", "q", 1, 0)
+        r.append(Request("p", "s", 2, 0))
+        self.assertEqual([x.peer_id for x in r[1:]], ["s"])
+        u = UploadBatch(["p"], ["q"], [4]) + [Upload("p", "s", 2)]
+        self.assertEqual([x.to_id for x in u], ["q", "s"])
+
+    def test_pickle(self):
+        b = downloads()
+        self.assertEqual(pickle.loads(pickle.dumps(b)), b)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import pickle
+import sys
+import unittest
+
+from pieceset import PieceSet
+
+
+class PieceSetTest(unittest.TestCase):
+    def setUp(self):
+        self.p = PieceSet.from_ids([1, 3, 5])
+
+    def check(self, result, ids):
+        self.assertTrue(isinstance(result, PieceSet), result)
+        self.assertEqual(sorted(result), sorted(ids))
+
+    def test_basics(self):
+        self.assertEqual(list(self.p), [1, 3, 5])
+        self.assertEqual(len(self.p), 3)
+        self.assertTrue(3 in self.p)
+        self.assertFalse(-1 in self.p)
+        self.assertFalse(PieceSet())
+        self.assertEqual(pickle.loads(pickle.dumps(self.p)), self.p)
+
+    def test_operators_with_piecesets(self):
+        q = PieceSet.from_ids([3, 4])
+        self.check(self.p & q, [3])
+        self.check(self.p | q, [1, 3, 4, 5])
+        self.check(self.p - q, [1, 5])
+        self.check(self.p ^ q, [1, 4, 5])
+
+    def test_operators_with_sets(self):
+        for s in (set([3, 4]), frozenset([3, 4])):
+            self.check(self.p & s, [3])
+            self.check(s & self.p, [3])
+            self.check(self.p | s, [1, 3, 4, 5])
+            self.check(s | self.p, [1, 3, 4, 5])
+            self.check(self.p - s, [1, 5])
+            self.check(s - self.p, [4])
+            self.check(self.p ^ s, [1, 4, 5])
+            self.check(s ^ self.p, [1, 4, 5])
+
+    def test_bad_operands(self):
+        self.assertRaises(TypeError, lambda: self.p & 3)
+        self.assertRaises(TypeError, lambda: self.p & [3])
+        self.assertRaises(TypeError, lambda: self.p | set(["a"]))
+
+    def test_named_methods(self):
+        self.check(self.p.union([2], set([7])), [1, 2, 3, 5, 7])
+        self.check(self.p.intersection([1, 3], (3, 5)), [3])
+        self.check(self.p.difference(range(2), [5]), [3])
+        self.check(self.p.symmetric_difference([5, 6]), [1, 3, 6])
+        self.assertTrue(self.p.issubset(range(6)))
+        self.assertFalse(self.p.issubset([1, 3]))
+        self.assertTrue(self.p.issuperset([1, 5]))
+        self.assertTrue(self.p.isdisjoint([0, 2]))
+        self.assertFalse(self.p.isdisjoint(set([5])))
+        self.assertTrue(self.p.copy() == self.p)
+
+    def test_comparisons(self):
+        self.assertEqual(self.p, set([1, 3, 5]))
+        self.assertEqual(self.p, frozenset([1, 3, 5]))
+        self.assertNotEqual(self.p, set([1, 3]))
+        self.assertNotEqual(self.p, [1, 3, 5])
+        self.assertEqual(hash(self.p), hash(frozenset([1, 3, 5])))
+        self.assertTrue(PieceSet.from_ids([1]) <= self.p)
+        self.assertTrue(PieceSet.from_ids([1]) < set([1, 3]))
+        self.assertFalse(self.p < self.p)
+        self.assertTrue(self.p >= frozenset([3]))
+        self.assertTrue(self.p > PieceSet())
+        if sys.version_info[0] >= 3:
+            # Python 2's sets don't defer comparisons to the other side
+            self.assertEqual(set([1, 3, 5]), self.p)
+            self.assertTrue(set([1]) <= self.p)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import resultcache
+from registry import AgentRegistry
+from resultcache import run_key, import_closure
+from util import Params
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+class RunKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sim_sources = resultcache.SIM_SOURCES
+        # A stand-in simulator, and an agent whose base class lives in
+        # another module
+        write(self.path("sim.py"), "import helper\n")
+        write(self.path("helper.py"), "X = 1\n")
+        write(self.path("base.py"),
+              "from peer import Peer\n\nclass BaseAgent(Peer):\n    pass\n")
+        write(self.path("agent.py"),
+              "import random\nfrom base import BaseAgent\n\n"
+              "class MyAgent(BaseAgent):\n    pass\n")
+        resultcache.SIM_SOURCES = [self.path("sim.py")]
+
+    def tearDown(self):
+        resultcache.SIM_SOURCES = self.sim_sources
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def key(self):
+        config = Params()
+        config.add("agent_classes", AgentRegistry(
+            self.dir, cache_path=False).classes(["MyAgent"]))
+        config.add("seed", 1)
+        return run_key(config)
+
+    def test_closure(self):
+        self.assertEqual(
+            sorted(import_closure([self.path("sim.py"),
+                                   self.path("agent.py")])),
+            ["agent", "base", "helper", "sim"])
+
+    def test_same_source_same_key(self):
+        self.assertEqual(self.key(), self.key())
+
+    def test_base_class_edit_changes_key(self):
+        before = self.key()
+        write(self.path("base.py"),
+              "from peer import Peer\n\nclass BaseAgent(Peer):\n    S = 3\n")
+        self.assertNotEqual(before, self.key())
+
+    def test_sim_module_edit_changes_key(self):
+        before = self.key()
+        write(self.path("helper.py"), "X = 2\n")
+        self.assertNotEqual(before, self.key())
+
+    def test_real_sim_closure(self):
+        names = import_closure(self.sim_sources)
+        for name in ["sim", "peer", "messages", "history", "validation",
+                     "stats", "pieceset", "rarity", "aggregate"]:
+            self.assertTrue(name in names, name)
+
+
+if __name__ == "__main__":
+    unittest.main()
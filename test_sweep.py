@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import sweep
+from sim import make_parser
+
+
+class SweepOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_point_configs_get_own_paths(self):
+        parser = make_parser()
+        (options, _) = parser.parse_args(["--trace", "t", "--checkpoint", "c"])
+        grid = sweep.parse_grid(parser, ["num-pieces=4,6"])
+        points = sweep.grid_points(grid)
+        configs = [sweep.point_config(options, ["Seed", "Dummy"], p, i,
+                                      len(points))
+                   for (i, p) in enumerate(points)]
+        self.assertEqual([c.trace for c in configs], ["t.point0", "t.point1"])
+        self.assertEqual([c.checkpoint for c in configs],
+                         ["c.point0", "c.point1"])
+        self.assertEqual([c.report for c in configs], [None, None])
+
+    def test_grid_over_output_option_is_kept(self):
+        parser = make_parser()
+        (options, _) = parser.parse_args([])
+        points = sweep.grid_points(sweep.parse_grid(parser, ["trace=a,b"]))
+        configs = [sweep.point_config(options, ["Seed", "Dummy"], p, i,
+                                      len(points))
+                   for (i, p) in enumerate(points)]
+        self.assertEqual([c.trace for c in configs], ["a", "b"])
+
+    def test_grid_values_converted_like_options(self):
+        parser = sweep.make_parser()
+        grid = dict(sweep.parse_grid(parser, [
+            "bounded-history=false,True", "budget=Seed=5,Dummy=2:40",
+            "max-bw=8", "num_pieces=3"]))
+        self.assertEqual(grid["bounded_history"], [False, True])
+        self.assertEqual(grid["budget"], [["Seed=5"], ["Dummy=2:40"]])
+        self.assertEqual(grid["max_up_bw"], [8])
+        self.assertEqual(grid["num_pieces"], [3])
+        (options, _) = parser.parse_args([])
+        config = sweep.point_config(options, ["Seed", "Dummy"],
+                                    {"bounded_history": False,
+                                     "budget": ["Dummy=2:40"]}, 0, 1)
+        self.assertFalse(config.bounded_history)
+        self.assertEqual(config.budgets, {"Dummy": (0.002, 0.04)})
+
+    def test_bad_grid_options(self):
+        parser = sweep.make_parser()
+        for spec in ["workers=1,2", "loglevel=info", "bounded-history=maybe",
+                     "no-such-option=1"]:
+            self.assertRaises(ValueError, sweep.parse_grid, parser, [spec])
+
+    def test_single_point_path_unchanged(self):
+        self.assertEqual(sweep.point_path("t", 0, 1), "t")
+
+    def test_sweep_writes_every_point(self):
+        sweep.main(["sweep.py", "--sweep-workers", "2", "--iters", "1",
+                    "--seed", "1", "--max-round", "10",
+                    "--grid", "num-pieces=3,4,5",
+                    "--trace", self.path("trace"),
+                    "--out", self.path("out.tsv"), "Seed", "Dummy,2"])
+        names = sorted(os.listdir(self.dir))
+        self.assertEqual(names, ["out.tsv", "trace.point0", "trace.point1",
+                                 "trace.point2"])
+        for name in names[1:]:
+            self.assertTrue(os.path.getsize(self.path(name)) > 0, name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+
+from messages import Request, RequestBatch, Upload, UploadBatch
+from pieceset import PieceSet
+from util import IllegalRequest, IllegalUpload
+from validation import Validator, LEVELS
+
+PEERS = ["a", "b", "c"]
+
+
+def validator(level):
+    return Validator(level, PEERS, {"a": 4, "b": 4, "c": 4}, num_pieces=3,
+                     blocks_per_piece=2, sample_rate=0.0, seed=0)
+
+
+def check_requests(level, requests):
+    peer_pieces = dict((pid, [0, 0, 0]) for pid in PEERS)
+    available = dict((pid, PieceSet.from_ids(range(3))) for pid in PEERS)
+    validator(level).check_requests(requests, peer_pieces, available)
+
+
+class ValidatorTest(unittest.TestCase):
+    def test_good_input_passes_at_every_level(self):
+        for level in LEVELS:
+            check_requests(level, {"a": [Request("a", "b", 2, 0)],
+                                   "b": RequestBatch(["b"], ["c"], [0], [0]),
+                                   "c": []})
+            validator(level).check_uploads({"a": [Upload("a", "b", 4)],
+                                            "b": UploadBatch(),
+                                            "c": []})
+
+    def test_unsafe_requests_rejected_at_every_level(self):
+        # sample_rate 0: "sampled" checks no lists against the rules
+        bad = [Request("a", "b", 3, 0),        # no such piece
+               Request("a", "b", -1, 0),       # would wrap around
+               Request("a", "b", 1.0, 0),      # not a piece id
+               Request("a", "z", 0, 0),        # no such peer
+               Request("a", "b", 0, 2),        # no such block
+               Request("a", "b", 0, "0"),      # not a block
+               Request("a", "b", 0, float("nan")),
+               Request("z", "b", 0, 0),        # no such requester
+               "not a request"]
+        for level in LEVELS:
+            for r in bad:
+                self.assertRaises(IllegalRequest, check_requests, level,
+                                  {"a": [Request("a", "c", 0, 0), r]})
+            self.assertRaises(IllegalRequest, check_requests, level,
+                              {"a": RequestBatch(["a"], ["b"], [7], [0])})
+            self.assertRaises(IllegalRequest, check_requests, level,
+                              {"a": RequestBatch(["a"], ["b"], [0, 1], [0])})
+
+    def test_fractional_start(self):
+        for level in LEVELS:
+            check_requests(level, {"a": [Request("a", "b", 0, 0.0)]})
+            self.assertRaises(IllegalRequest, check_requests, level,
+                              {"a": [Request("a", "b", 0, 2.5)]})
+
+    def test_rules_only_checked_when_sampled_in(self):
+        # Starts past the first block the peer doesn't have
+        requests = {"a": [Request("a", "b", 0, 1)]}
+        self.assertRaises(IllegalRequest, check_requests, "full", requests)
+        check_requests("sampled", requests)
+        check_requests("off", requests)
+
+    def test_off_only_reports_safety_problems(self):
+        # The wrong requester is a rule, so off doesn't report it, even
+        # when another element fails a safety check
+        try:
+            check_requests("off", {"a": [Request("b", "c", 0, 0),
+                                         Request("a", "c", 9, 0)]})
+        except IllegalRequest as e:
+            self.assertTrue("non-existent piece" in str(e), str(e))
+        else:
+            self.fail("no IllegalRequest")
+        check_requests("off", {"a": [Request("b", "c", 0, 0)]})
+
+    def test_nan_among_good_values(self):
+        # min() and max() skip over a NaN that isn't first
+        for level in LEVELS:
+            self.assertRaises(IllegalUpload, validator(level).check_uploads,
+                              {"a": UploadBatch(["a", "a"], ["b", "c"],
+                                                [1, float("nan")])})
+            self.assertRaises(IllegalRequest, check_requests, level,
+                              {"a": RequestBatch(["a", "a"], ["b", "b"],
+                                                 [0, 1], [0, float("nan")])})
+
+    def test_unsafe_uploads_rejected_at_every_level(self):
+        bad = [Upload("a", "z", 1),       # no such peer
+               Upload("a", "b", -1),      # negative bandwidth
+               Upload("a", "b", "1"),     # not a bandwidth
+               Upload("a", "b", float("inf")),
+               Upload("a", "b", float("nan")),
+               "not an upload"]
+        for level in LEVELS:
+            for u in bad:
+                self.assertRaises(IllegalUpload,
+                                  validator(level).check_uploads, {"a": [u]})
+
+    def test_upload_rules(self):
+        for uploads in ({"a": [Upload("a", "a", 1)]},
+                        {"a": [Upload("b", "c", 1)]},
+                        {"a": [Upload("a", "b", 3), Upload("a", "c", 2)]}):
+            self.assertRaises(IllegalUpload,
+                              validator("full").check_uploads, uploads)
+            validator("off").check_uploads(uploads)
+
+    def test_error_names_element(self):
+        try:
+            check_requests("off", {"a": [Request("a", "b", 9, 0)]})
+        except IllegalRequest as e:
+            self.assertTrue("non-existent piece" in str(e))
+            self.assertTrue("piece_id=9" in str(e))
+        else:
+            self.fail("no IllegalRequest")
+
+
+if __name__ == "__main__":
+    unittest.main()
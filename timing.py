@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+"""
+Wall and CPU time spent in each phase of the round loop, and in each
+agent's calls, for finding a slow strategy or a slow part of the engine
+without profiling the whole process.
+"""
+
+import json
+import threading
+import time
+
+# CPU time of the process, and of the calling thread where Python can
+# tell (3.7+); agent calls may run on the agent thread pool.  Elsewhere
+# thread_time is the process's, so it counts every thread's work.
+process_time = getattr(time, "process_time", None) or time.clock
+per_thread_time = hasattr(time, "thread_time")
+thread_time = getattr(time, "thread_time", None) or process_time
+
+# "uploads" includes bucketing the requests by target, and "transfer"
+# includes marking finished peers done.
+PHASES = ("requests", "request_validation", "uploads", "upload_validation",
+          "transfer", "history", "logging")
+
+
+class Timings:
+    def __init__(self):
+        self.rounds = 0
+        self.phases = dict((name, [0.0, 0.0]) for name in PHASES)
+        # [wall, cpu, calls], by agent class name and by peer id
+        self.agent_classes = dict()
+        self.peers = dict()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Mark the start of a phase; pass the result to end()."""
+        return (time.time(), process_time())
+
+    def end(self, phase, started):
+        (wall, cpu) = started
+        t = self.phases[phase]
+        t[0] += time.time() - wall
+        t[1] += process_time() - cpu
+
+    def agent_call(self, p, f, *args):
+        """Call f(*args) on behalf of peer p, and charge the time to it."""
+        wall = time.time()
+        cpu = thread_time()
+        ans = f(*args)
+        wall = time.time() - wall
+        cpu = thread_time() - cpu
+        with self.lock:
+            for (d, k) in ((self.agent_classes, p.__class__.__name__),
+                           (self.peers, p.id)):
+                t = d.get(k)
+                if t is None:
+                    t = d[k] = [0.0, 0.0, 0]
+                t[0] += wall
+                t[1] += cpu
+                t[2] += 1
+        return ans
+
+    def to_dict(self):
+        def agents(d):
+            return dict((k, {"wall": w, "cpu": c, "calls": n})
+                        for (k, (w, c, n)) in d.items())
+        return {"rounds": self.rounds,
+                "phases": dict((name, {"wall": w, "cpu": c})
+                               for (name, (w, c)) in self.phases.items()),
+                "agent_classes": agents(self.agent_classes),
+                "peers": agents(self.peers)}
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1, sort_keys=True)
+
+    def pretty(self):
+        lines = ["%-20s %9s %9s" % ("phase", "wall", "cpu")]
+        for name in PHASES:
+            (w, c) = self.phases[name]
+            lines.append("%-20s %9.4f %9.4f" % (name, w, c))
+        lines.append("%-20s %9s %9s %7s" % ("agent class", "wall", "cpu", "calls"))
+        for name in sorted(self.agent_classes):
+            (w, c, n) = self.agent_classes[name]
+            lines.append("%-20s %9.4f %9.4f %7d" % (name, w, c, n))
+        return "\n".join(lines)
+
+
+class NoTimings:
+    """Stands in for Timings when timing is off."""
+    def start(self):
+        return None
+
+    def end(self, phase, started):
+        pass
+
+    def agent_call(self, p, f, *args):
+        return f(*args)
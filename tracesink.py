@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+"""
+Machine-readable record of a simulation, as newline-delimited JSON.
+
+One line per record:
+  {"type": "start", "peers": [...], "upload_rates": {...},
+   "done": [peer ids that start with every piece]}
+  {"type": "round", "round": r,
+   "downloads": [[from_id, to_id, piece, blocks], ...],
+   "uploads": [[from_id, to_id, bw], ...],
+   "done": [peer ids that finished this round]}
+  {"type": "end", "rounds": n}
+
+Records are kept in memory and written out in bulk every `buffer_rounds`
+rounds, and when the sink is closed.
+
+To carry on an existing trace (after resuming from a checkpoint), pass
+the offset it was flushed to; anything after it is dropped.
+"""
+
+import json
+
+
+class TraceSink:
+    def __init__(self, path, buffer_rounds=256, offset=None):
+        if offset is None:
+            self.f = open(path, "w")
+        else:
+            self.f = open(path, "r+")
+            self.f.seek(offset)
+            self.f.truncate()
+        self.buffer_rounds = buffer_rounds
+        self.pending = []
+
+    def start(self, peer_ids, upload_rates, done):
+        self.pending.append({"type": "start",
+                             "peers": peer_ids,
+                             "upload_rates": upload_rates,
+                             "done": done})
+
+    def round(self, round, peer_ids, downloads, uploads, done):
+        """
+        downloads: dict : peer_id -> DownloadBatch to that peer this round
+        uploads: dict : peer_id -> UploadBatch from that peer this round
+        done: list of peer ids that finished this round
+        """
+        dls = [list(row) for pid in peer_ids for row in downloads[pid].rows()]
+        ups = [list(row) for pid in peer_ids for row in uploads[pid].rows()]
+        self.pending.append({"type": "round", "round": round,
+                             "downloads": dls, "uploads": ups, "done": done})
+        if len(self.pending) >= self.buffer_rounds:
+            self.flush()
+
+    def end(self, rounds):
+        self.pending.append({"type": "end", "rounds": rounds})
+
+    def flush(self):
+        if self.pending:
+            lines = [json.dumps(rec, separators=(",", ":"))
+                     for rec in self.pending]
+            self.f.write("\n".join(lines) + "\n")
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def read_trace(path):
+    """Yield the records of a trace file, in order."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -4,7 +4,6 @@
 
 # http://stackoverflow.com/questions/5098580/implementing-argmax-in-python
 
-from itertools import imap, izip, count
 import math
 
 
@@ -12,14 +11,14 @@ def argmax(pairs):
     """
     given an iterable of pairs return the key corresponding to the greatest value
     """
-    return max(pairs, key=lambda (a,b): b)[0]
+    return max(pairs, key=lambda pair: pair[1])[0]
 
  
 def argmax_index(values):
     """
     given an iterable of values return the index of the greatest value
     """
-    return argmax(izip(count(), values))
+    return argmax(enumerate(values))
 
 def argmax_f(keys, f):
     """
@@ -31,7 +30,11 @@ def argmax_f_tuples(keys, f):
     """
     given an iterable of key tuples and a function f, return the key with largest f(*key)
     """
-    return max(imap(lambda key: (f(*key), key), keys))[1]
+    return max((f(*key), key) for key in keys)[1]
+
+def none_first(value):
+    """Sort key that puts None before any number, like Python 2 does."""
+    return (value is not None, value)
 
 def mean(lst):
     """Throws a div by zero exception if list is empty"""
@@ -48,10 +51,10 @@ def median(numeric):
     vals = sorted(numeric)
     count = len(vals)
     if count % 2 == 1:
-        return vals[(count+1)/2-1]
+        return vals[(count+1)//2-1]
     else:
-        lower = vals[count/2-1]
-        upper = vals[count/2]
+        lower = vals[count//2-1]
+        upper = vals[count//2]
         return (float(lower + upper)) / 2
 
 
@@ -81,8 +84,8 @@ def even_split(n, k):
         raise TypeError("n and k must be ints")
 
     r = n % k
-    ans = ([n/k] * (k-r))
-    ans.extend([n/k + 1] * r)
+    ans = ([n//k] * (k-r))
+    ans.extend([n//k + 1] * r)
     return ans
 
 
@@ -100,6 +103,20 @@ def load_modules(agent_classes):
     
 
 
+class lazy_str:
+    """
+    Stands in for a string that is expensive to build.  Pass it as a
+    logging argument -- logging.debug("%s", lazy_str(f, x)) -- and f(x)
+    only runs if the message is actually emitted.
+    """
+    def __init__(self, f, *args):
+        self.f = f
+        self.args = args
+
+    def __str__(self):
+        return str(self.f(*self.args))
+
+
 class Params:
     def __init__(self):
         self._init_keys = set(self.__dict__.keys())
@@ -107,6 +124,11 @@ class Params:
     def add(self, k, v):
         self.__dict__[k] = v
 
+    def items(self):
+        """The (key, value) pairs added with add()."""
+        return [(k, v) for (k, v) in self.__dict__.items()
+                if k != "_init_keys" and k not in self._init_keys]
+
     def __repr__(self):
         return "; ".join("%s=%s" % (k, str(self.__dict__[k])) for k in self.__dict__.keys() if k not in self._init_keys)
         
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+
+"""
+Checks that the requests and uploads agents hand back follow the rules.
+
+A Validator is built once per simulation, with the tables it needs (peer
+ids, upload limits, ...), and then checks a whole round's requests or
+uploads.  The first problem found is raised with the offending element.
+
+Levels:
+  full     check every peer's list, every round.
+  sampled  check a random fraction of the peers' lists each round.
+  off      only the safety checks below.
+
+Whatever the level, every list gets the checks without which the sim
+itself would crash or quietly misbehave: message types, piece ids and
+start blocks in range, and peer ids that exist (and non-negative
+bandwidths).  These are done a column at a time, so they're cheap.
+Only the rules that need the round's piece state (requesting the next
+block of a piece the peer has, upload limits, ...) are sampled or
+skipped.
+"""
+
+import numbers
+import random
+
+from messages import Upload, Request, RequestBatch, UploadBatch
+from util import IllegalUpload, IllegalRequest
+
+LEVELS = ("full", "sampled", "off")
+
+INF = float("inf")
+
+
+def of_type(column, kind):
+    """True if every value in the column is an instance of kind."""
+    return all(issubclass(t, kind) for t in set(map(type, column)))
+
+
+def in_range(column, lo, hi):
+    """
+    True if lo <= x < hi for every x in a column of numbers, none of them
+    NaN (which min() and max() can't be trusted with).
+    """
+    if not of_type(column, numbers.Integral):
+        if any(x != x for x in column):
+            return False
+    return not column or (min(column) >= lo and max(column) < hi)
+
+
+def number_in(x, kind, lo, hi):
+    """One value's in_range(), for finding the bad element."""
+    return isinstance(x, kind) and x == x and lo <= x < hi
+
+
+def element(message_class, row):
+    """A bad element, for the error message."""
+    try:
+        return repr(message_class(*row))
+    except (TypeError, ValueError, OverflowError):
+        # Fields the repr can't format
+        return "%s%r" % (message_class.__name__, tuple(row))
+
+
+class Validator:
+    def __init__(self, level, peer_ids, upload_limits, num_pieces,
+                 blocks_per_piece, sample_rate=0.1, seed=None):
+        """
+        upload_limits: dict : peer_id -> up_bw
+        sample_rate: fraction of lists checked per round when sampled
+        seed: seed for picking the sample.  Sampling uses its own random
+              generator so it doesn't change what the sim does.
+        """
+        if level not in LEVELS:
+            raise ValueError("Unknown validation level: %s" % level)
+        self.level = level
+        self.peer_set = frozenset(peer_ids)
+        self.upload_limits = upload_limits
+        self.num_pieces = num_pieces
+        self.blocks_per_piece = blocks_per_piece
+        self.sample_rate = sample_rate
+        self.rng = random.Random(seed)
+
+    def to_check(self, lists):
+        """The (peer_id, list) pairs to apply the rules to this round."""
+        if self.level == "off":
+            return []
+        if self.level == "sampled":
+            rate = self.sample_rate
+            rng = self.rng
+            return [(pid, lst) for (pid, lst) in lists.items()
+                    if rng.random() < rate]
+        return lists.items()
+
+    def known(self, ids):
+        """True if every id in ids is a peer id."""
+        try:
+            return self.peer_set.issuperset(ids)
+        except TypeError:   # unhashable
+            return False
+
+    def check_requests(self, requests, peer_pieces, available):
+        """
+        requests: dict : peer_id -> [Requests] or RequestBatch made by that
+                  peer this round
+        peer_pieces: the round-start piece state
+        available: dict : peer_id -> pieces available from that peer
+
+        Raise an IllegalRequest exception if there is a problem.  Returns
+        dict : peer_id -> the peer's requests as a RequestBatch.
+        """
+        batches = dict((peer_id, self.request_bounds(peer_id, rs))
+                       for (peer_id, rs) in requests.items())
+
+        def bad(msg, row):
+            raise IllegalRequest("%s Bad element: %s" %
+                                 (msg, element(Request, row)))
+
+        for (peer_id, _) in self.to_check(requests):
+            have = peer_pieces[peer_id]
+            for row in batches[peer_id].rows():
+                (requester_id, to_id, piece_id, start) = row
+                if requester_id != peer_id:
+                    bad("Request has wrong peer id!", row)
+                # Must request the _next_ necessary block
+                if start > have[piece_id]:
+                    bad("Request has bad start block!", row)
+                if piece_id not in available[to_id]:
+                    bad("Asking for piece peer does not have!", row)
+        # If we got here, looks ok
+        return batches
+
+    def request_bounds(self, peer_id, rs):
+        """
+        The safety checks for one peer's requests: raise IllegalRequest
+        unless every element is a Request for a piece that exists (an int
+        id) and a start block within it (fractions are fine, as partly
+        downloaded blocks are), between peers that exist.  Returns the
+        requests as a RequestBatch.
+        """
+        if isinstance(rs, RequestBatch):
+            if not rs.well_formed():
+                raise IllegalRequest("RequestBatch columns differ in length.")
+            batch = rs
+        else:
+            for r in rs:
+                if not isinstance(r, Request):
+                    raise IllegalRequest("List of Requests contains "
+                                         "non-Request object. Bad element: "
+                                         "%s" % (r,))
+            batch = RequestBatch.from_list(rs)
+        # Whole columns at a time, while everything's fine
+        if (of_type(batch.piece_ids, numbers.Integral) and
+            of_type(batch.starts, numbers.Real) and
+            in_range(batch.piece_ids, 0, self.num_pieces) and
+            in_range(batch.starts, 0, self.blocks_per_piece) and
+            self.known(batch.requester_ids) and self.known(batch.peer_ids)):
+            return batch
+        # Something's wrong: find the first bad element, going by the
+        # same checks one element at a time
+        for row in batch.rows():
+            (requester_id, to_id, piece_id, start) = row
+            if not number_in(piece_id, numbers.Integral, 0, self.num_pieces):
+                msg = "Request asks for non-existent piece!"
+            elif not self.known([requester_id, to_id]):
+                msg = "Request mentions non-existent peer!"
+            elif not number_in(start, numbers.Real, 0, self.blocks_per_piece):
+                msg = "Request has bad start block!"
+            else:
+                continue
+            raise IllegalRequest("%s Bad element: %s" %
+                                 (msg, element(Request, row)))
+        raise IllegalRequest("Bad requests from %s: %s" % (peer_id, rs))
+
+    def check_uploads(self, uploads):
+        """
+        uploads: dict : peer_id -> [Uploads] or UploadBatch made by that
+                 peer this round
+
+        Raise an IllegalUpload exception if there is a problem.  Returns
+        dict : peer_id -> the peer's uploads as an UploadBatch.
+        """
+        batches = dict((peer_id, self.upload_bounds(peer_id, us))
+                       for (peer_id, us) in uploads.items())
+
+        def bad(msg, row):
+            raise IllegalUpload("%s Bad element: %s" %
+                                (msg, element(Upload, row)))
+
+        for (peer_id, _) in self.to_check(uploads):
+            batch = batches[peer_id]
+            for row in batch.rows():
+                (from_id, to_id, bw) = row
+                if to_id == peer_id:
+                    bad("Can't upload to yourself.", row)
+                if from_id != peer_id:
+                    bad("Upload.from != peer id.", row)
+
+            limit = self.upload_limits[peer_id]
+            if sum(batch.bws) > limit:
+                raise IllegalUpload("Can't upload more than limit of %d. %s" % (
+                    limit, uploads[peer_id]))
+        # If we got here, looks ok.
+        return batches
+
+    def upload_bounds(self, peer_id, us):
+        """
+        The safety checks for one peer's uploads: raise IllegalUpload
+        unless every element is an Upload of a finite, non-negative bandwidth
+        between peers that exist.  Returns the uploads as an UploadBatch.
+        """
+        if isinstance(us, UploadBatch):
+            if not us.well_formed():
+                raise IllegalUpload("UploadBatch columns differ in length.")
+            batch = us
+        else:
+            for u in us:
+                if not isinstance(u, Upload):
+                    raise IllegalUpload("List of Uploads contains non-Upload "
+                                        "object. Bad element: %s" % (u,))
+            batch = UploadBatch.from_list(us)
+        if (of_type(batch.bws, numbers.Real) and
+            in_range(batch.bws, 0, INF) and
+            self.known(batch.from_ids) and self.known(batch.to_ids)):
+            return batch
+        for row in batch.rows():
+            (from_id, to_id, bw) = row
+            if not self.known([from_id, to_id]):
+                msg = "Upload mentions non-existent peer!"
+            elif not number_in(bw, numbers.Real, 0, INF):
+                msg = "Upload bandwidth must be a non-negative number!"
+            else:
+                continue
+            raise IllegalUpload("%s Bad element: %s" %
+                                (msg, element(Upload, row)))
+        raise IllegalUpload("Bad uploads from %s: %s" % (peer_id, us))